@@ -1,7 +1,13 @@
 import os
+import re
 import logging
+from datetime import timedelta
+from decimal import Decimal
+import orjson
+from itertools import chain
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Load environment variables from .env file
@@ -10,12 +16,69 @@ from .database import DatabaseManager
 from .nlp_service import NLPService
 from .query_generator import QueryGenerator
 from .semantic_mapper import SemanticMapper
+from .semantic_cache import SemanticCache, openai_embedder
 
-# Configure logging for debugging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; set LOG_LEVEL=DEBUG when debugging
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+
+# Patterns in generation errors mapped to user-facing messages; first match wins
+_ERROR_MESSAGES = [
+    (re.compile(r"unknown table", re.I),
+     "I couldn't understand your question properly. Try asking about bike trips, stations, or weather data."),
+    (re.compile(r"llm failed", re.I),
+     "I had trouble processing your question. Please try rephrasing it or ask about specific bike share data like trip counts or station usage."),
+    (re.compile(r"^(?=.*column)(?=.*does not exist)", re.I | re.S),
+     "I couldn't find the data you're looking for. Try asking about bike trips, station locations, or usage patterns."),
+]
+_DEFAULT_ERROR_MESSAGE = "I couldn't process your question. Please try asking about bike share trips, stations, or usage data."
+
+def _friendly_error(error_msg):
+    """Map an internal error message to one suitable for users"""
+    for pattern, message in _ERROR_MESSAGES:
+        if pattern.search(error_msg):
+            return message
+    return _DEFAULT_ERROR_MESSAGE
+
+# Longest question accepted by /query
+MAX_QUESTION_LENGTH = 512
+
+# Words that tie a question to the bike-share data; matched as word prefixes
+_DOMAIN_TERMS_RE = re.compile(
+    r"\b(?:trip|ride|rode|riding|ridden|journey|bike|bicycl|cycl|station|dock|depart|arriv"
+    r"|weather|rain|precipitation|temperature|distance|kilomet|duration)",
+    re.I
+)
+# Entity categories filled from the domain keyword tables rather than generic NER
+_DOMAIN_ENTITY_KEYS = ('time_periods', 'weather_conditions', 'measurements', 'demographics', 'filters')
+_OFF_TOPIC_MESSAGE = "Sorry, I can only answer questions about bike trips, stations, or weather data."
+
+def _has_domain_signal(question, entities):
+    """Check that a question mentions something the bike-share data can answer"""
+    if any(entities.get(key) for key in _DOMAIN_ENTITY_KEYS):
+        return True
+    return _DOMAIN_TERMS_RE.search(question) is not None
+
+def _json_default(value):
+    """Serialize database types that orjson does not handle natively"""
+    # Ride times come back as timedelta; show them in minutes
+    if isinstance(value, timedelta):
+        return round(value.total_seconds() / 60, 1)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Create Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 # app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 # app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
@@ -24,6 +87,28 @@ db_manager = DatabaseManager()
 nlp_service = NLPService()
 semantic_mapper = SemanticMapper(db_manager)
 query_generator = QueryGenerator(db_manager, semantic_mapper)
+semantic_cache = SemanticCache(
+    openai_embedder(query_generator.openai_client),
+    maxsize=int(os.getenv('SEMANTIC_CACHE_SIZE', 512)),
+    similarity_threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92))
+)
+
+def warm_caches():
+    """
+    Load everything the first request would otherwise pay for: the database
+    pool, the introspected schema and the spaCy pipeline
+    """
+    try:
+        db_manager.test_connection()
+        db_manager.get_schema_info()
+    except Exception as e:
+        logging.warning(f"Database warmup failed: {e}")
+    nlp_service.nlp("warmup")
+
+@app.cli.command('warmup')
+def warmup_command():
+    """Warm the schema cache and load the NLP model"""
+    warm_caches()
 
 @app.route('/')
 def index():
@@ -38,16 +123,17 @@ def query():
     Returns: {"sql": "<final-query>", "result": <rows | scalar>, "error": <null | "message">}
     """
     try:
-        # Validate request
-        if not request.is_json:
+        # Validate request; the body is parsed once, by the orjson provider
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
             return jsonify({
                 "sql": None,
                 "result": None,
                 "error": "Request must be JSON"
             }), 400
         
-        data = request.get_json()
-        question = data.get('question', '').strip()
+        question = data.get('question')
+        question = question.strip() if isinstance(question, str) else ''
         
         if not question:
             return jsonify({
@@ -56,24 +142,38 @@ def query():
                 "error": "Question is required"
             }), 400
         
-        # Extract entities using NER
-        entities = nlp_service.extract_entities(question)
-        logging.debug(f"Extracted entities: {entities}")
+        if len(question) > MAX_QUESTION_LENGTH:
+            return jsonify({
+                "sql": None,
+                "result": None,
+                "error": f"Question must be at most {MAX_QUESTION_LENGTH} characters"
+            }), 400
         
-        # Generate SQL query using LLM
-        sql_result = query_generator.generate_query(question, entities)
+        # Common questions have precomputed SQL and skip NLP and the LLM
+        sql_result = query_generator.lookup_faq(question)
+        
+        if sql_result is None:
+            # Extract entities using NER
+            entities = nlp_service.extract_entities(question)
+            logging.debug(f"Extracted entities: {entities}")
+            
+            # Turn away questions with nothing bike-share related before paying for an LLM call
+            if not _has_domain_signal(question, entities):
+                return jsonify({
+                    "sql": None,
+                    "result": None,
+                    "error": _OFF_TOPIC_MESSAGE
+                })
+            
+            # Generate SQL query using LLM, reusing SQL from equivalent earlier questions
+            sql_result = semantic_cache.get_or_generate(
+                question, entities,
+                lambda: query_generator.generate_query(question, entities)
+            )
         
         if sql_result.get('error'):
             # Make error messages more user-friendly
-            error_msg = sql_result['error']
-            if "unknown table" in error_msg.lower():
-                user_friendly_error = "I couldn't understand your question properly. Try asking about bike trips, stations, or weather data."
-            elif "llm failed" in error_msg.lower():
-                user_friendly_error = "I had trouble processing your question. Please try rephrasing it or ask about specific bike share data like trip counts or station usage."
-            elif "column" in error_msg.lower() and "does not exist" in error_msg.lower():
-                user_friendly_error = "I couldn't find the data you're looking for. Try asking about bike trips, station locations, or usage patterns."
-            else:
-                user_friendly_error = "I couldn't process your question. Please try asking about bike share trips, stations, or usage data."
+            user_friendly_error = _friendly_error(sql_result['error'])
             
             return jsonify({
                 "sql": sql_result.get('sql'),
@@ -85,51 +185,48 @@ def query():
         sql_query = sql_result['sql']
         params = sql_result.get('params', [])
         
-        result = db_manager.execute_query(sql_query, params)
-        
-        # Handle empty results with user-friendly messages
-        if not result or (isinstance(result, list) and len(result) == 0):
-            return jsonify({
-                "sql": sql_query,
-                "result": None,
-                "error": "No data found matching your criteria. Try asking about available bikes, trips, or stations."
-            })
-        
-        # Format result based on query type
-        if isinstance(result, list) and len(result) == 1 and len(result[0]) == 1:
-            # Single scalar value
-            value = list(result[0].values())[0]
-            # Handle None/null results
-            if value is None:
+        # Stream rows from a server-side cursor; peeking at the first two is
+        # enough to tell an empty or scalar result from a row set
+        rows = db_manager.execute_query(sql_query, params, stream=True)
+        streamed = False
+        try:
+            first = next(rows, None)
+            second = next(rows, None) if first is not None else None
+            
+            # Handle empty results with user-friendly messages
+            if first is None:
                 return jsonify({
                     "sql": sql_query,
                     "result": None,
                     "error": "No data found matching your criteria. Try asking about available bikes, trips, or stations."
                 })
-            # Handle timedelta objects for ride time calculations
-            if hasattr(value, 'total_seconds'):
-                formatted_result = round(value.total_seconds() / 60, 1)  # Convert to minutes
-            else:
-                formatted_result = value
-        else:
-            # Multiple rows or multiple columns
-            formatted_result = []
-            if result:
-                for row in result:
-                    formatted_row = {}
-                    for key, value in row.items():
-                        # Handle timedelta objects
-                        if hasattr(value, 'total_seconds'):
-                            formatted_row[key] = round(value.total_seconds() / 60, 1)
-                        else:
-                            formatted_row[key] = value
-                    formatted_result.append(formatted_row)
-        
-        return jsonify({
-            "sql": sql_query,
-            "result": formatted_result,
-            "error": None
-        })
+            
+            # Format result based on query type
+            if second is None and len(first) == 1:
+                # Single scalar value
+                value = list(first.values())[0]
+                # Handle None/null results
+                if value is None:
+                    return jsonify({
+                        "sql": sql_query,
+                        "result": None,
+                        "error": "No data found matching your criteria. Try asking about available bikes, trips, or stations."
+                    })
+                
+                return jsonify({
+                    "sql": sql_query,
+                    "result": value,
+                    "error": None
+                })
+            
+            # Multiple rows or multiple columns; _stream_rows closes rows when done
+            streamed = True
+            return Response(stream_with_context(_stream_rows(sql_query, [row for row in (first, second) if row is not None], rows)),
+                            mimetype='application/json')
+        finally:
+            # Hand the connection back to the pool unless the response still reads from it
+            if not streamed:
+                rows.close()
         
     except Exception as e:
         logging.error(f"Query processing error: {str(e)}")
@@ -139,6 +236,24 @@ def query():
             "error": "Sorry, I couldn't process your question. Please try asking about bike trips, station usage, or weather data."
         }), 500
 
+def _stream_rows(sql_query, head, rows):
+    """
+    Yield the /query response body one row at a time
+    head holds the rows already taken from the rows iterator
+    """
+    yield '{"sql": ' + app.json.dumps(sql_query) + ', "error": null, "result": ['
+    try:
+        for i, row in enumerate(chain(head, rows)):
+            yield (',' if i else '') + app.json.dumps(row)
+    except Exception as e:
+        # Headers are already sent, so the response is cut short instead
+        logging.error(f"Result streaming error: {str(e)}")
+        raise
+    finally:
+        # Hand the connection back to the pool even if the client disconnects
+        rows.close()
+    yield ']}'
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -148,6 +263,3 @@ def health():
         return jsonify({"status": "healthy", "database": "connected"})
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
-
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
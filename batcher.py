@@ -0,0 +1,80 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+class RequestBatcher:
+    """
+    Coalesces concurrent calls into batches
+    Callers block in submit() while a background thread gathers up to
+    max_batch_size items, or whatever arrived within max_wait seconds of the
+    first one, and hands them to flush() in a single call. A caller waits at
+    most timeout seconds for its batch, so a stuck flush or a dead collector
+    thread cannot block it forever
+    """
+
+    def __init__(self, flush: Callable[[List[Any]], List[Any]], max_batch_size: int = 8,
+                 max_wait: float = 0.025, max_in_flight: int = 4, timeout: Optional[float] = None):
+        self.flush = flush
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._executor = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any) -> Any:
+        """
+        Queue an item and block until its batch has been flushed
+        Raises TimeoutError if that takes longer than timeout seconds
+        """
+        if self.max_batch_size <= 1:
+            return self.flush([item])[0]
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result(timeout=self.timeout)
+
+    def _ensure_worker(self):
+        """Start the collector thread on first use"""
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                                        thread_name_prefix='batch-flush')
+                    self._worker = threading.Thread(target=self._collect, name='batch-collector', daemon=True)
+                    self._worker.start()
+
+    def _collect(self):
+        """Gather queued items into batches and dispatch them"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Flush on the pool so one slow batch does not hold up the next
+            self._executor.submit(self._flush_batch, batch)
+
+    def _flush_batch(self, batch: List[Tuple[Any, Future]]):
+        """Run flush() for a batch and resolve each caller's future"""
+        try:
+            results = self.flush([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Batch flush returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            logging.error(f"Batch flush failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
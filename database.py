@@ -1,31 +1,219 @@
 import os
+import re
+import stat
+import json
+import time
+import atexit
+import getpass
+import hashlib
 import logging
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Any, Optional
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, execute_batch
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+# Seconds a cached schema stays valid before it is introspected again
+SCHEMA_CACHE_TTL = int(os.getenv('SCHEMA_CACHE_TTL', 600))
+
+# Where a local PostgreSQL server listens for Unix socket connections
+LOCAL_SOCKET_DIR = os.getenv('DB_SOCKET_DIR', '/var/run/postgresql')
+
+# Open cache files without following a planted symlink, where supported
+_O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)
+
+def _schema_cache_dir() -> str:
+    """
+    Return the per-user directory for the shared schema cache, creating it
+    with mode 0700. Raises OSError if the directory is a symlink, is owned by
+    another user or is readable by others, since its contents reach the LLM prompt
+    """
+    base = os.environ.get('XDG_CACHE_HOME')
+    if base:
+        path = os.path.join(base, 'bikeshare')
+    else:
+        user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+        path = os.path.join(tempfile.gettempdir(), f"bikeshare-{user}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError(f"Schema cache directory {path} is not a directory")
+    if hasattr(os, 'getuid') and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        raise OSError(f"Schema cache directory {path} must be owned by this user with mode 0700")
+    return path
+
+# Tables queries may read from
+ALLOWED_TABLES = ('bikes', 'trips', 'stations', 'daily_weather')
+_ALLOWED_TABLE_SET = frozenset(ALLOWED_TABLES)
+
+# SQL tokens: string literals, quoted and bare identifiers, and single symbols
+_SQL_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[A-Za-z_][A-Za-z0-9_$]*|\S")
+
+# Keywords that end a FROM list, and those that open a nested query
+_FROM_END_KEYWORDS = frozenset({
+    'where', 'group', 'having', 'window', 'order', 'limit', 'offset', 'fetch',
+    'for', 'union', 'intersect', 'except', 'returning'
+})
+_QUERY_KEYWORDS = frozenset({'select', 'with', 'values'})
+
+def _relation_names(sql_query: str) -> Iterator[str]:
+    """
+    Yield the first name of every relation a query reads from
+    Every item of a FROM list and every JOIN target is yielded, inside
+    subqueries too. A parenthesized join or other non-query parenthesis
+    in a relation position yields '(' so it never passes an allow list;
+    FROM inside a function call such as EXTRACT(ISODOW FROM started_at)
+    or after IS DISTINCT is not a relation
+    """
+    tokens = [token.lower() for token in _SQL_TOKEN_RE.findall(sql_query)]
+    # One [is_query, in_from_list] frame per open parenthesis
+    frames = [[True, False]]
+    expecting = False
+    for i, token in enumerate(tokens):
+        frame = frames[-1]
+        following = tokens[i + 1] if i + 1 < len(tokens) else ''
+        if token == '(':
+            is_query = following in _QUERY_KEYWORDS
+            if expecting and not is_query:
+                yield token
+            frames.append([is_query, False])
+            expecting = False
+        elif token == ')':
+            if len(frames) > 1:
+                frames.pop()
+            expecting = False
+        elif not frame[0]:
+            continue
+        elif expecting:
+            if token not in ('only', 'lateral'):
+                # A schema-qualified name never matches an unqualified table
+                yield token.strip('"') + ('.' if following == '.' else '')
+                expecting = False
+        elif token == 'from' and (i == 0 or tokens[i - 1] != 'distinct'):
+            frame[1] = expecting = True
+        elif token == 'join' or (token == ',' and frame[1]):
+            expecting = True
+        elif token in _FROM_END_KEYWORDS or token == 'select':
+            frame[1] = False
+
+def format_schema_prompt(schema_info: Dict[str, Any]) -> str:
+    """Format schema information for LLM consumption"""
+    lines = []
+    for table_name, table_info in schema_info.items():
+        lines.append("")
+        lines.append(f"Table: {table_name}")
+        lines.append("Columns:")
+        
+        for column in table_info['columns']:
+            line = f"  - {column['name']} ({column['type']})"
+            if not column['nullable']:
+                line += " NOT NULL"
+            if column['key_type'] == 'PRIMARY KEY':
+                line += " PRIMARY KEY"
+            lines.append(line)
+        
+        if table_info['foreign_keys']:
+            lines.append("Foreign Keys:")
+            for fk in table_info['foreign_keys']:
+                lines.append(f"  - {fk['column']} -> {fk['references_table']}.{fk['references_column']}")
+    
+    return "\n".join(lines) + "\n" if lines else ""
+
 class DatabaseManager:
     """Handles PostgreSQL database connections and queries"""
     load_dotenv()
-    def __init__(self):
-        self.connection_params = {
+    # Connection pools shared by all managers with the same connection settings
+    _pools: Dict[Tuple[Tuple[str, str], ...], Any] = {}
+    _pools_lock = threading.Lock()
+    
+    def __init__(self, dsn: Optional[str] = None):
+        """Settings come from the DB_* variables; a dsn such as TEST_DATABASE_URL overrides them"""
+        params = {
             'host': os.getenv('DB_HOST'),
             'port': 5432,
             'database': os.getenv('DB_NAME'),
             'user': os.getenv('DB_USER'),
-            'password': os.getenv('DB_PASSWORD')
+            'password': os.getenv('DB_PASSWORD'),
+            'sslmode': os.getenv('DB_SSLMODE', 'prefer')
         }
+        if dsn:
+            parsed = psycopg2.extensions.parse_dsn(dsn)
+            params['database'] = parsed.pop('dbname', params['database'])
+            params.update(parsed)
+        # A co-located server is reached over its Unix socket, skipping TCP and TLS
+        if params['host'] in (None, '', 'localhost', '127.0.0.1') and os.path.isdir(LOCAL_SOCKET_DIR):
+            params['host'] = LOCAL_SOCKET_DIR
+        self.connection_params = params
         self._schema_cache = None
+        self._schema_cache_ts = 0.0
+        self._pool_key = tuple(sorted((key, str(value)) for key, value in params.items()))
     
+    def _get_pool(self):
+        """Return the pool for this manager's connection settings, creating it on first use"""
+        pool = self._pools.get(self._pool_key)
+        if pool is None:
+            with self._pools_lock:
+                pool = self._pools.get(self._pool_key)
+                if pool is None:
+                    try:
+                        pool = psycopg2.pool.ThreadedConnectionPool(
+                            minconn=2,
+                            maxconn=int(os.getenv('DB_POOL_MAX', 16)),
+                            **self.connection_params
+                        )
+                    except Exception as e:
+                        logging.error(f"Database connection failed: {e}")
+                        raise
+                    self._pools[self._pool_key] = pool
+        return pool
+    
+    @contextmanager
     def get_connection(self):
-        """Create and return a database connection"""
+        """
+        Check out a pooled database connection
+        Commits on success, rolls back on error and always returns the connection to the pool
+        Connections are in autocommit mode, so single statements skip the
+        BEGIN/COMMIT round trips; turn it off to run a transaction
+        """
+        pool = self._get_pool()
+        conn = pool.getconn()
         try:
-            conn = psycopg2.connect(**self.connection_params)
-            return conn
-        except Exception as e:
-            logging.error(f"Database connection failed: {e}")
+            conn.autocommit = True
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
             raise
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+    
+    def close(self):
+        """Close the pooled connections for this manager's connection settings"""
+        with self._pools_lock:
+            pool = self._pools.pop(self._pool_key, None)
+        if pool is not None:
+            pool.closeall()
+    
+    @classmethod
+    def close_all(cls):
+        """Close every connection pool"""
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.closeall()
     
     def test_connection(self):
         """Test database connectivity"""
@@ -34,11 +222,23 @@ class DatabaseManager:
                 cur.execute("SELECT 1")
                 return cur.fetchone()[0] == 1
     
-    def execute_query(self, query: str, params: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+    def validate_table_access(self, sql_query: str) -> bool:
+        """
+        Check that every relation the query reads from is in ALLOWED_TABLES
+        Covers every item of a FROM list, JOIN targets and subqueries;
+        parenthesized joins, schema-qualified names and table functions are rejected
+        """
+        return all(name in _ALLOWED_TABLE_SET for name in _relation_names(sql_query))
+    
+    def execute_query(self, query: str, params: Optional[List[Any]] = None, stream: bool = False) -> List[Dict[str, Any]]:
         """
         Execute a parameterized SQL query and return results
         Uses parameterized queries to prevent SQL injection
+        With stream=True an iterator from stream_query() is returned instead
         """
+        if stream:
+            return self.stream_query(query, params)
+        
         try:
             with self.get_connection() as conn:
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -48,8 +248,8 @@ class DatabaseManager:
                         cur.execute(query)
                     
                     if cur.description:
-                        results = cur.fetchall()
-                        return [dict(row) for row in results]
+                        # RealDictRow is already a dict, so rows are returned as-is
+                        return cur.fetchall()
                     else:
                         return []
                         
@@ -59,98 +259,233 @@ class DatabaseManager:
             logging.error(f"Params: {params}")
             raise
     
+    def execute_many(self, query: str, params_list: List[List[Any]], page_size: int = 100) -> None:
+        """
+        Execute a parameterized statement once for each parameter list
+        Statements are sent page_size at a time, one round trip per page,
+        in a single transaction
+        """
+        try:
+            with self.get_connection() as conn:
+                conn.autocommit = False
+                with conn.cursor() as cur:
+                    execute_batch(cur, query, params_list, page_size=page_size)
+                    
+        except Exception as e:
+            logging.error(f"Batch execution failed: {e}")
+            logging.error(f"Query: {query}")
+            raise
+    
+    def stream_query(self, query: str, params: Optional[List[Any]] = None, itersize: int = 2000) -> Iterator[Dict[str, Any]]:
+        """
+        Execute a parameterized SELECT query and yield rows as they are fetched
+        Uses a server-side cursor so at most itersize rows are held in memory;
+        the pooled connection is kept until the iterator is exhausted or closed
+        """
+        try:
+            with self.get_connection() as conn:
+                # Server-side cursors only live inside a transaction
+                conn.autocommit = False
+                with conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cur:
+                    cur.itersize = itersize
+                    cur.execute(query, params or None)
+                    yield from cur
+                        
+        except Exception as e:
+            logging.error(f"Query execution failed: {e}")
+            logging.error(f"Query: {query}")
+            logging.error(f"Params: {params}")
+            raise
+    
     def get_schema_info(self) -> Dict[str, Any]:
         """
-        Dynamically introspect database schema using information_schema
-        Returns detailed information about tables and columns
+        Return schema information, introspecting the database only when needed
+        The result is cached in-process and in a file shared by all worker
+        processes; both expire after SCHEMA_CACHE_TTL seconds
         """
-        if self._schema_cache:
+        if self._schema_cache is not None and time.time() - self._schema_cache_ts < SCHEMA_CACHE_TTL:
             return self._schema_cache
         
-        schema_query = """
+        # Hold the file lock while introspecting so concurrent workers wait
+        # for one catalog query instead of all running it
+        with self._schema_file_lock():
+            cached = self._read_schema_file()
+            if cached is None:
+                cached = {'ts': time.time(), 'schema': self._introspect_schema()}
+                self._write_schema_file(cached)
+        
+        self._schema_cache = cached['schema']
+        self._schema_cache_ts = cached['ts']
+        return self._schema_cache
+    
+    def invalidate_schema(self):
+        """Drop the cached schema so the next access introspects the database again"""
+        self._schema_cache = None
+        self._schema_cache_ts = 0.0
+        try:
+            os.remove(self._schema_cache_path())
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove schema cache: {e}")
+    
+    def _schema_cache_path(self) -> str:
+        """Path of the shared schema cache file for this database; raises OSError if unsafe"""
+        params = self.connection_params
+        dsn = f"{params['host']}:{params['port']}/{params['database']}:{params['user']}"
+        key = hashlib.sha1(dsn.encode()).hexdigest()[:16]
+        return os.path.join(_schema_cache_dir(), f"bikeshare_schema_{key}.json")
+    
+    @contextmanager
+    def _schema_file_lock(self):
+        """Hold an exclusive lock on the shared schema cache"""
+        if fcntl is None:
+            yield
+            return
+        try:
+            fd = os.open(self._schema_cache_path() + '.lock',
+                         os.O_WRONLY | os.O_CREAT | os.O_APPEND | _O_NOFOLLOW, 0o600)
+            lock_file = os.fdopen(fd, 'a')
+        except OSError:
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _read_schema_file(self) -> Optional[Dict[str, Any]]:
+        """Load the shared schema cache, returning None if missing or expired"""
+        try:
+            with os.fdopen(os.open(self._schema_cache_path(), os.O_RDONLY | _O_NOFOLLOW)) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached.get('ts', 0) >= SCHEMA_CACHE_TTL:
+            return None
+        return cached
+    
+    def _write_schema_file(self, cached: Dict[str, Any]):
+        """Atomically replace the shared schema cache"""
+        try:
+            path = self._schema_cache_path()
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cached, f, default=str)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write schema cache: {e}")
+    
+    def _introspect_schema(self) -> Dict[str, Any]:
+        """
+        Dynamically introspect database schema using pg_catalog
+        Returns detailed information about tables and columns
+        """
+        # information_schema views wrap pg_catalog in security-barrier views;
+        # querying the catalog directly gives the same answer far more cheaply
+        columns_query = """
+        SELECT 
+            c.relname AS table_name,
+            a.attname AS column_name,
+            format_type(a.atttypid, NULL) AS data_type,
+            NOT a.attnotnull AS is_nullable,
+            pg_get_expr(d.adbin, d.adrelid) AS column_default,
+            information_schema._pg_char_max_length(a.atttypid, a.atttypmod) AS character_maximum_length,
+            information_schema._pg_numeric_precision(a.atttypid, a.atttypmod) AS numeric_precision,
+            information_schema._pg_numeric_scale(a.atttypid, a.atttypmod) AS numeric_scale
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_attribute a 
+            ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE n.nspname = 'public' 
+        AND c.relkind IN ('r', 'p')
+        ORDER BY c.relname, a.attnum;
+        """
+        
+        keys_query = """
         SELECT 
-            t.table_name,
-            c.column_name,
-            c.data_type,
-            c.is_nullable,
-            c.column_default,
-            c.character_maximum_length,
-            c.numeric_precision,
-            c.numeric_scale,
-            CASE 
-                WHEN pk.column_name IS NOT NULL THEN 'PRIMARY KEY'
-                WHEN fk.column_name IS NOT NULL THEN 'FOREIGN KEY'
-                ELSE 'REGULAR'
-            END as key_type,
-            fk.foreign_table_name,
-            fk.foreign_column_name
-        FROM information_schema.tables t
-        LEFT JOIN information_schema.columns c ON t.table_name = c.table_name
-        LEFT JOIN (
-            SELECT 
-                kcu.column_name, 
-                kcu.table_name
-            FROM information_schema.table_constraints tc
-            JOIN information_schema.key_column_usage kcu 
-                ON tc.constraint_name = kcu.constraint_name
-            WHERE tc.constraint_type = 'PRIMARY KEY'
-        ) pk ON c.column_name = pk.column_name AND c.table_name = pk.table_name
-        LEFT JOIN (
-            SELECT 
-                kcu.column_name,
-                kcu.table_name,
-                ccu.table_name AS foreign_table_name,
-                ccu.column_name AS foreign_column_name
-            FROM information_schema.table_constraints AS tc
-            JOIN information_schema.key_column_usage AS kcu
-                ON tc.constraint_name = kcu.constraint_name
-            JOIN information_schema.constraint_column_usage AS ccu
-                ON ccu.constraint_name = tc.constraint_name
-            WHERE tc.constraint_type = 'FOREIGN KEY'
-        ) fk ON c.column_name = fk.column_name AND c.table_name = fk.table_name
-        WHERE t.table_schema = 'public' 
-        AND t.table_type = 'BASE TABLE'
-        ORDER BY t.table_name, c.ordinal_position;
+            c.relname AS table_name,
+            a.attname AS column_name,
+            con.contype,
+            fc.relname AS foreign_table_name,
+            fa.attname AS foreign_column_name
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        CROSS JOIN LATERAL unnest(con.conkey, con.confkey) AS k(attnum, foreign_attnum)
+        JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+        LEFT JOIN pg_class fc ON fc.oid = con.confrelid
+        LEFT JOIN pg_attribute fa ON fa.attrelid = con.confrelid AND fa.attnum = k.foreign_attnum
+        WHERE n.nspname = 'public' 
+        AND con.contype IN ('p', 'f');
         """
         
         try:
-            results = self.execute_query(schema_query)
-            
-            # Organize schema information by table
-            schema_info = {}
-            for row in results:
-                table_name = row['table_name']
-                if table_name not in schema_info:
-                    schema_info[table_name] = {
-                        'columns': [],
-                        'primary_keys': [],
-                        'foreign_keys': []
-                    }
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute(keys_query)
+                    keys = cur.fetchall()
                 
-                if row['column_name']:  # Skip tables without columns
-                    column_info = {
-                        'name': row['column_name'],
-                        'type': row['data_type'],
-                        'nullable': row['is_nullable'] == 'YES',
-                        'default': row['column_default'],
-                        'max_length': row['character_maximum_length'],
-                        'precision': row['numeric_precision'],
-                        'scale': row['numeric_scale'],
-                        'key_type': row['key_type']
-                    }
-                    
-                    schema_info[table_name]['columns'].append(column_info)
-                    
-                    if row['key_type'] == 'PRIMARY KEY':
-                        schema_info[table_name]['primary_keys'].append(row['column_name'])
-                    elif row['key_type'] == 'FOREIGN KEY':
-                        schema_info[table_name]['foreign_keys'].append({
-                            'column': row['column_name'],
-                            'references_table': row['foreign_table_name'],
-                            'references_column': row['foreign_column_name']
-                        })
+                # Index key constraints by column; a primary key wins over a foreign key
+                primary_keys = set()
+                foreign_keys = {}
+                for row in keys:
+                    key = (row['table_name'], row['column_name'])
+                    if row['contype'] == 'p':
+                        primary_keys.add(key)
+                    else:
+                        foreign_keys.setdefault(key, row)
+                
+                # Organize schema information by table, streaming the column rows
+                # from a server-side cursor, which only lives inside a transaction
+                conn.autocommit = False
+                schema_info = {}
+                with conn.cursor(name='schema_cur', cursor_factory=RealDictCursor) as cur:
+                    cur.itersize = 500
+                    cur.execute(columns_query)
+                    for row in cur:
+                        table_name = row['table_name']
+                        if table_name not in schema_info:
+                            schema_info[table_name] = {
+                                'columns': [],
+                                'primary_keys': [],
+                                'foreign_keys': []
+                            }
+                        
+                        if row['column_name']:  # Skip tables without columns
+                            key = (table_name, row['column_name'])
+                            if key in primary_keys:
+                                key_type = 'PRIMARY KEY'
+                            elif key in foreign_keys:
+                                key_type = 'FOREIGN KEY'
+                            else:
+                                key_type = 'REGULAR'
+                            
+                            column_info = {
+                                'name': row['column_name'],
+                                'type': row['data_type'],
+                                'nullable': row['is_nullable'],
+                                'default': row['column_default'],
+                                'max_length': row['character_maximum_length'],
+                                'precision': row['numeric_precision'],
+                                'scale': row['numeric_scale'],
+                                'key_type': key_type
+                            }
+                            
+                            schema_info[table_name]['columns'].append(column_info)
+                            
+                            if key_type == 'PRIMARY KEY':
+                                schema_info[table_name]['primary_keys'].append(row['column_name'])
+                            elif key_type == 'FOREIGN KEY':
+                                schema_info[table_name]['foreign_keys'].append({
+                                    'column': row['column_name'],
+                                    'references_table': foreign_keys[key]['foreign_table_name'],
+                                    'references_column': foreign_keys[key]['foreign_column_name']
+                                })
             
-            self._schema_cache = schema_info
             return schema_info
             
         except Exception as e:
@@ -158,11 +493,58 @@ class DatabaseManager:
             raise
     
     def get_sample_values(self, table_name: str, column_name: str, limit: int = 10) -> List[Any]:
-        """Get sample values from a column for semantic mapping"""
+        """
+        Get sample values from a column for semantic mapping
+        Values keep their database types (ints, dates, Decimals); see
+        get_sample_values_bulk for many columns as text in one query
+        """
+        query = sql.SQL("SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL LIMIT %s").format(
+            table=sql.Identifier(table_name),
+            column=sql.Identifier(column_name)
+        )
         try:
-            query = f"SELECT DISTINCT {column_name} FROM {table_name} WHERE {column_name} IS NOT NULL LIMIT %s"
-            results = self.execute_query(query, [limit])
-            return [list(row.values())[0] for row in results]
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, [limit])
+                    return [row[0] for row in cur.fetchall()]
         except Exception as e:
             logging.error(f"Failed to get sample values for {table_name}.{column_name}: {e}")
             return []
+    
+    def get_sample_values_bulk(self, columns: List[Tuple[str, str]], limit: int = 10) -> Dict[Tuple[str, str], List[Any]]:
+        """
+        Get sample values for many (table, column) pairs in a single query
+        Returns {(table, column): [values as text]}; on failure every pair maps to []
+        """
+        if not columns:
+            return {}
+        
+        # One UNION ALL round trip instead of a query per column; the text cast
+        # lets columns of different types share a result set
+        subquery = sql.SQL(
+            "SELECT {t_name} AS _t, {c_name} AS _c, val FROM ("
+            "SELECT DISTINCT {column}::text AS val FROM {table} WHERE {column} IS NOT NULL LIMIT %s"
+            ") sub"
+        )
+        query = sql.SQL(" UNION ALL ").join(
+            subquery.format(
+                t_name=sql.Literal(table_name),
+                c_name=sql.Literal(column_name),
+                table=sql.Identifier(table_name),
+                column=sql.Identifier(column_name)
+            )
+            for table_name, column_name in columns
+        )
+        
+        samples = {(table_name, column_name): [] for table_name, column_name in columns}
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, [limit] * len(columns))
+                    for table_name, column_name, value in cur.fetchall():
+                        samples[(table_name, column_name)].append(value)
+        except Exception as e:
+            logging.error(f"Failed to get sample values for {len(columns)} columns: {e}")
+        return samples
+
+atexit.register(DatabaseManager.close_all)
@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+
+# Production server settings: gunicorn -c gunicorn.conf.py main:app
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Requests spend most of their time waiting on PostgreSQL and OpenAI, so
+# cooperative gevent workers serve many of them concurrently per process
+worker_class = 'gevent'
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+timeout = 60
+
+# Load the app in each worker after gevent has patched the standard library,
+# so connection pools and background threads are created green
+preload_app = False
+
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    """Make psycopg2 yield to other greenlets while waiting on the database"""
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+
+def post_worker_init(worker):
+    """Warm caches before the worker accepts its first request"""
+    from app import warm_caches
+    warm_caches()
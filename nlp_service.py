@@ -1,27 +1,166 @@
+import os
 import spacy
 import logging
-from typing import Dict, List, Any, Optional
+import threading
+from copy import deepcopy
+from functools import lru_cache
+from typing import Dict, List, Any, FrozenSet, Optional, Set, Tuple
 from datetime import datetime, timedelta
 import re
 
+# Pipeline components not needed for named entity recognition
+SPACY_EXCLUDED_COMPONENTS = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer"]
+
+# Domain keyword tables used for pattern-based entity extraction
+TIME_PERIOD_PATTERNS = [
+    'last month',
+    'this month',
+    'june 2025',
+    'first week of june',
+    'morning',
+    'afternoon',
+    'evening',
+    'night',
+    'weekday',
+    'weekend'
+]
+
+WEATHER_KEYWORDS = {
+    'rainy': ['rainy', 'rain', 'wet'],
+    'sunny': ['sunny', 'clear', 'dry'],
+    'hot': ['hot', 'warm', 'high temperature'],
+    'cold': ['cold', 'cool', 'low temperature']
+}
+
+AGGREGATION_KEYWORDS = {
+    'count': ['how many', 'count', 'number of'],
+    'average': ['average', 'avg', 'mean'],
+    'sum': ['total', 'sum', 'add up'],
+    'max': ['maximum', 'max', 'highest', 'most'],
+    'min': ['minimum', 'min', 'lowest', 'least']
+}
+
+MEASUREMENT_KEYWORDS = {
+    'distance': ['kilometres', 'kilometers', 'km', 'distance', 'miles'],
+    'time': ['minutes', 'hours', 'time', 'duration'],
+    'temperature': ['degrees', 'celsius', 'fahrenheit', 'temp'],
+    'precipitation': ['mm', 'millimeters', 'rain', 'precipitation']
+}
+
+DEMOGRAPHIC_KEYWORDS = {
+    'gender': ['women', 'men', 'male', 'female', 'non-binary'],
+    'age': ['young', 'old', 'adult', 'senior', 'teen']
+}
+
+# Station names mentioned in the schema
+STATION_NAMES = [
+    'congress avenue', 'barton springs', 'capitol square',
+    'east side', 'river walk'
+]
+
+LOCATION_TERMS = ['station', 'docking point', 'departure', 'arrival']
+
+
+def build_keyword_scanner(tags_by_keyword: Dict[str, Set[Tuple[str, Any]]]) -> Tuple[re.Pattern, Dict[str, FrozenSet[Tuple[str, Any]]]]:
+    """
+    Compile every keyword into one pattern that finds all of them in a single pass
+    The alternation sits in a lookahead so matches may overlap, and tries longer
+    keywords first; since only one keyword is captured per position, each keyword
+    also carries the tags of every keyword that is a prefix of it
+    """
+    keywords = sorted(tags_by_keyword, key=len, reverse=True)
+    pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in keywords) + '))')
+    tags = {
+        keyword: frozenset().union(*(tags_by_keyword[prefix] for prefix in keywords if keyword.startswith(prefix)))
+        for keyword in keywords
+    }
+    return pattern, tags
+
+
+def _keyword_tags() -> Dict[str, Set[Tuple[str, Any]]]:
+    """Map each keyword in the domain tables to the (kind, value) tags it signals"""
+    tags_by_keyword: Dict[str, Set[Tuple[str, Any]]] = {}
+    
+    def add(keyword, tag):
+        tags_by_keyword.setdefault(keyword, set()).add(tag)
+    
+    for pattern in TIME_PERIOD_PATTERNS:
+        add(pattern, ('time_period', pattern))
+    for marker in ('june 2025', 'first week', 'june'):
+        add(marker, ('marker', marker))
+    for kind, table in (('weather', WEATHER_KEYWORDS), ('aggregation', AGGREGATION_KEYWORDS),
+                        ('measurement', MEASUREMENT_KEYWORDS)):
+        for name, keywords in table.items():
+            for keyword in keywords:
+                add(keyword, (kind, name))
+    for demo_type, keywords in DEMOGRAPHIC_KEYWORDS.items():
+        for keyword in keywords:
+            add(keyword, ('demographic', (demo_type, keyword)))
+    for station in STATION_NAMES:
+        add(station, ('station', station))
+    for term in LOCATION_TERMS:
+        add(term, ('location_term', term))
+    return tags_by_keyword
+
+
+_KEYWORD_RE, _KEYWORD_TAGS = build_keyword_scanner(_keyword_tags())
+
+
+@lru_cache(maxsize=None)
+def load_spacy_model():
+    """
+    Load the spaCy English model with only the components we use
+    The pipeline is read-only at inference time, so it is loaded once per
+    process and shared by every NLPService
+    """
+    try:
+        # Only doc.ents is read, so skip everything but NER; in
+        # en_core_web_sm the NER component has its own tok2vec layer
+        return spacy.load("en_core_web_sm", exclude=SPACY_EXCLUDED_COMPONENTS)
+    except OSError:
+        # Fallback if model is not installed
+        logging.warning("spaCy English model not found, using blank model")
+        return spacy.blank("en")
+
+
 class NLPService:
     """Natural Language Processing service using spaCy for entity extraction"""
     
     def __init__(self):
-        try:
-            # Load spaCy English model
-            self.nlp = spacy.load("en_core_web_sm")
-        except OSError:
-            # Fallback if model is not installed
-            logging.warning("spaCy English model not found, using blank model")
-            self.nlp = spacy.blank("en")
+        self._nlp = None
+        self._nlp_lock = threading.Lock()
+        # Extraction is deterministic in the normalized text, so repeated
+        # questions are served from a per-instance LRU cache
+        self._extract_entities_cached = lru_cache(
+            maxsize=int(os.getenv('ENTITY_CACHE_SIZE', 4096))
+        )(self._extract_entities)
+    
+    @property
+    def nlp(self):
+        """spaCy pipeline, loaded on first use"""
+        if self._nlp is None:
+            with self._nlp_lock:
+                if self._nlp is None:
+                    self._nlp = self._load_model()
+        return self._nlp
+    
+    def _load_model(self):
+        """Return the process-wide spaCy pipeline"""
+        return load_spacy_model()
     
     def extract_entities(self, text: str) -> Dict[str, Any]:
         """
         Extract relevant entities from natural language query
         Returns structured entity information for SQL generation
         """
-        doc = self.nlp(text.lower())
+        # Lowercase once; every pattern table below is lowercase
+        text = " ".join((text or "").lower().split())
+        # Callers may mutate the result, so never hand out the cached dict
+        return deepcopy(self._extract_entities_cached(text))
+    
+    def _extract_entities(self, text: str) -> Dict[str, Any]:
+        """Extract entities from lowercased, whitespace-normalized text"""
+        doc = self.nlp(text)
         
         entities = {
             'numbers': [],
@@ -50,119 +189,73 @@ class NLPService:
             elif ent.label_ == 'ORG':
                 entities['organizations'].append(ent.text)
         
-        # Extract domain-specific patterns
-        self._extract_time_patterns(text, entities)
-        self._extract_weather_patterns(text, entities)
-        self._extract_aggregation_patterns(text, entities)
-        self._extract_measurement_patterns(text, entities)
-        self._extract_demographic_patterns(text, entities)
-        self._extract_location_patterns(text, entities)
+        # Extract domain-specific patterns from a single keyword scan
+        hits = self._scan_keywords(text)
+        self._extract_time_patterns(hits, entities)
+        self._extract_weather_patterns(hits, entities)
+        self._extract_aggregation_patterns(hits, entities)
+        self._extract_measurement_patterns(hits, entities)
+        self._extract_demographic_patterns(hits, entities)
+        self._extract_location_patterns(hits, entities)
         
         return entities
     
-    def _extract_time_patterns(self, text: str, entities: Dict[str, Any]):
+    def _scan_keywords(self, text: str) -> Set[Tuple[str, Any]]:
+        """Return the tags of every domain keyword occurring in text"""
+        hits = set()
+        for keyword in set(_KEYWORD_RE.findall(text)):
+            hits |= _KEYWORD_TAGS[keyword]
+        return hits
+    
+    def _extract_time_patterns(self, hits: Set[Tuple[str, Any]], entities: Dict[str, Any]):
         """Extract time-related patterns from text"""
-        # Date patterns
-        date_patterns = [
-            r'last month',
-            r'this month',
-            r'june 2025',
-            r'first week of june',
-            r'morning',
-            r'afternoon',
-            r'evening',
-            r'night',
-            r'weekday',
-            r'weekend'
-        ]
-        
-        for pattern in date_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
+        for pattern in TIME_PERIOD_PATTERNS:
+            if ('time_period', pattern) in hits:
                 entities['time_periods'].append(pattern)
         
         # Specific date extraction
-        if 'june 2025' in text:
+        if ('marker', 'june 2025') in hits:
             entities['dates'].append('2025-06')
-        if 'first week' in text and 'june' in text:
+        if ('marker', 'first week') in hits and ('marker', 'june') in hits:
             entities['dates'].append('2025-06-01 to 2025-06-07')
     
-    def _extract_weather_patterns(self, text: str, entities: Dict[str, Any]):
+    def _extract_weather_patterns(self, hits: Set[Tuple[str, Any]], entities: Dict[str, Any]):
         """Extract weather-related patterns"""
-        weather_patterns = {
-            'rainy': ['rainy', 'rain', 'wet'],
-            'sunny': ['sunny', 'clear', 'dry'],
-            'hot': ['hot', 'warm', 'high temperature'],
-            'cold': ['cold', 'cool', 'low temperature']
-        }
-        
-        for condition, keywords in weather_patterns.items():
-            for keyword in keywords:
-                if keyword in text:
-                    entities['weather_conditions'].append(condition)
-                    break
+        for condition in WEATHER_KEYWORDS:
+            if ('weather', condition) in hits:
+                entities['weather_conditions'].append(condition)
     
-    def _extract_aggregation_patterns(self, text: str, entities: Dict[str, Any]):
+    def _extract_aggregation_patterns(self, hits: Set[Tuple[str, Any]], entities: Dict[str, Any]):
         """Extract aggregation operations from text"""
-        aggregation_patterns = {
-            'count': ['how many', 'count', 'number of'],
-            'average': ['average', 'avg', 'mean'],
-            'sum': ['total', 'sum', 'add up'],
-            'max': ['maximum', 'max', 'highest', 'most'],
-            'min': ['minimum', 'min', 'lowest', 'least']
-        }
-        
-        for agg_type, keywords in aggregation_patterns.items():
-            for keyword in keywords:
-                if keyword in text:
-                    entities['aggregations'].append(agg_type)
-                    break
+        for agg_type in AGGREGATION_KEYWORDS:
+            if ('aggregation', agg_type) in hits:
+                entities['aggregations'].append(agg_type)
     
-    def _extract_measurement_patterns(self, text: str, entities: Dict[str, Any]):
+    def _extract_measurement_patterns(self, hits: Set[Tuple[str, Any]], entities: Dict[str, Any]):
         """Extract measurement-related terms"""
-        measurements = {
-            'distance': ['kilometres', 'kilometers', 'km', 'distance', 'miles'],
-            'time': ['minutes', 'hours', 'time', 'duration'],
-            'temperature': ['degrees', 'celsius', 'fahrenheit', 'temp'],
-            'precipitation': ['mm', 'millimeters', 'rain', 'precipitation']
-        }
-        
-        for measure_type, keywords in measurements.items():
-            for keyword in keywords:
-                if keyword in text:
-                    entities['measurements'].append(measure_type)
-                    break
+        for measure_type in MEASUREMENT_KEYWORDS:
+            if ('measurement', measure_type) in hits:
+                entities['measurements'].append(measure_type)
     
-    def _extract_demographic_patterns(self, text: str, entities: Dict[str, Any]):
+    def _extract_demographic_patterns(self, hits: Set[Tuple[str, Any]], entities: Dict[str, Any]):
         """Extract demographic information"""
-        demographics = {
-            'gender': ['women', 'men', 'male', 'female', 'non-binary'],
-            'age': ['young', 'old', 'adult', 'senior', 'teen']
-        }
-        
-        for demo_type, keywords in demographics.items():
+        for demo_type, keywords in DEMOGRAPHIC_KEYWORDS.items():
             for keyword in keywords:
-                if keyword in text:
+                if ('demographic', (demo_type, keyword)) in hits:
                     entities['demographics'].append({
                         'type': demo_type,
                         'value': keyword
                     })
     
-    def _extract_location_patterns(self, text: str, entities: Dict[str, Any]):
+    def _extract_location_patterns(self, hits: Set[Tuple[str, Any]], entities: Dict[str, Any]):
         """Extract location-specific patterns"""
-        # Look for station names mentioned in the schema
-        station_names = [
-            'congress avenue', 'barton springs', 'capitol square', 
-            'east side', 'river walk'
-        ]
-        
-        for station in station_names:
-            if station in text:
+        for station in STATION_NAMES:
+            if ('station', station) in hits:
                 entities['locations'].append(station)
         
         # General location terms
-        location_terms = ['station', 'docking point', 'departure', 'arrival']
-        for term in location_terms:
-            if term in text:
+        for term in LOCATION_TERMS:
+            if ('location_term', term) in hits:
                 entities['filters'].append({
                     'type': 'location',
                     'value': term
@@ -1,63 +1,55 @@
+import asyncio
 import json
 import logging
 import os
+import re
+import threading
 import unicodedata
-from typing import Dict, List, Any, Optional
-from openai import OpenAI
-from .database import DatabaseManager
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator
+import httpx
+import orjson
+from openai import AsyncOpenAI, OpenAI
+from .batcher import RequestBatcher
+from .database import ALLOWED_TABLES, DatabaseManager, format_schema_prompt
 from .semantic_mapper import SemanticMapper
+from .semantic_cache import normalize_question
 
-class QueryGenerator:
-    """Generates SQL queries from natural language using LLM"""
-    
-    def __init__(self, db_manager: DatabaseManager, semantic_mapper: SemanticMapper):
-        self.db_manager = db_manager
-        self.semantic_mapper = semantic_mapper
-        self.openai_client = OpenAI(
-            api_key=os.environ.get("OPENAI_API_KEY", "default_key")
-        )
-    
-    def generate_query(self, question: str, entities: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Generate SQL query from natural language question and extracted entities
-        Returns: {"sql": str, "params": list, "error": str or None}
-        """
-        try:
-            # Get schema information
-            schema_info = self.db_manager.get_schema_info()
-            
-            # Get semantic mappings for the question
-            semantic_mappings = self.semantic_mapper.map_entities_to_schema(question, entities)
-            
-            # Generate SQL using LLM
-            sql_result = self._generate_sql_with_llm(question, entities, schema_info, semantic_mappings)
-            
-            return sql_result
-            
-        except Exception as e:
-            logging.error(f"Query generation failed: {e}")
-            return {
-                "sql": None,
-                "params": [],
-                "error": f"Query generation error: {str(e)}"
-            }
-    
-    def _generate_sql_with_llm(self, question: str, entities: Dict[str, Any], 
-                               schema_info: Dict[str, Any], 
-                               semantic_mappings: Dict[str, Any]) -> Dict[str, Any]:
-        """Use OpenAI GPT-4o to generate SQL query"""
-        
-        # Prepare schema information for the LLM
-        schema_description = self._format_schema_for_llm(schema_info)
-        
-        # Create system prompt - using string concatenation to avoid f-string issues with JSON
-        system_prompt = """You are an expert SQL query generator for a bike-share analytics system.
+try:
+    import hyperscan
+except ImportError:  # pragma: no cover - optional, the re patterns are used instead
+    hyperscan = None
+
+SINGLE_RESPONSE_FORMAT = """Return JSON in this exact format:
+{
+    "sql": "SELECT ... FROM ... WHERE ... ",
+    "params": [param1, param2, ...],
+    "explanation": "Brief explanation of the query logic"
+}"""
+
+BATCH_RESPONSE_FORMAT = """You will receive several questions, each with an id. Answer every one of them.
+Return JSON in this exact format:
+{
+    "results": [
+        {
+            "id": 0,
+            "sql": "SELECT ... FROM ... WHERE ... ",
+            "params": [param1, param2, ...],
+            "explanation": "Brief explanation of the query logic"
+        }
+    ]
+}"""
+
+# System prompt shared by every question; only the schema and response format vary
+_SYSTEM_PROMPT_TEMPLATE = """You are an expert SQL query generator for a bike-share analytics system.
 
 DATABASE SCHEMA:
-""" + schema_description + """
+{schema}
 
 SEMANTIC MAPPINGS:
-""" + json.dumps(semantic_mappings, indent=2) + """
+Provided with each question in the user message.
 
 RULES:
 1. Generate ONLY parameterized SQL queries (use %s for parameters)
@@ -105,182 +97,859 @@ BIKE MODELS - CRITICAL UNICODE HANDLING:
 - When generating bike_model filters, use these exact Unicode strings
 - Example: bike_model = 'E‑Bike' (with Unicode ‑ hyphen)
 
-Return JSON in this exact format:
-{
-    "sql": "SELECT ... FROM ... WHERE ... ",
-    "params": [param1, param2, ...],
-    "explanation": "Brief explanation of the query logic"
-}"""
+{response_format}"""
 
-        user_prompt = f"""
-Convert this natural language question to SQL:
-"{question}"
+# Frequently asked questions with precomputed SQL, keyed by normalized question
+FAQ_QUERIES = {
+    "what bike models are available": {
+        "sql": "SELECT DISTINCT bike_model FROM bikes ORDER BY bike_model",
+        "params": []
+    },
+    "how many trips were there in total": {
+        "sql": "SELECT COUNT(*) AS trip_count FROM trips",
+        "params": []
+    },
+    "how many trips happened in june 2025": {
+        "sql": "SELECT COUNT(*) AS trip_count FROM trips WHERE started_at >= %s AND started_at < %s",
+        "params": ["2025-06-01", "2025-07-01"]
+    },
+    "show me weekend trips": {
+        "sql": "SELECT * FROM trips WHERE EXTRACT(DOW FROM started_at) IN (0, 6) ORDER BY started_at",
+        "params": []
+    }
+}
 
-Extracted entities: {json.dumps(entities, indent=2)}
+# Statements and comment markers never allowed in generated SQL
+_DANGEROUS_SQL_RE = re.compile(
+    r"\b(?:DELETE|UPDATE|INSERT|DROP|ALTER|TRUNCATE|CREATE|UNION)\b|--|/\*",
+    re.IGNORECASE
+)
+# The public validator also rejects a quote closing a literal before a new statement
+_UNSAFE_SQL_RE = re.compile(_DANGEROUS_SQL_RE.pattern + r"|';", re.IGNORECASE)
 
-Focus on:
-1. Identifying the main metric requested (count, average, sum, etc.)
-2. Applying appropriate filters based on entities
-3. Joining tables as needed
-4. Using parameterized queries for safety
-"""
+# The same patterns as one Hyperscan database, when Hyperscan is installed
+_QUOTE_BREAK_ID = 3
 
-        try:
-            # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-            # do not change this unless explicitly requested by the user
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.1
+def _compile_unsafe_sql_db():
+    """Compile the unsafe SQL patterns for Hyperscan, or return None without it"""
+    if hyperscan is None:
+        return None
+    db = hyperscan.Database()
+    db.compile(
+        expressions=[
+            rb"\b(?:DELETE|UPDATE|INSERT|DROP|ALTER|TRUNCATE|CREATE|UNION)\b",
+            rb"--",
+            rb"/\*",
+            rb"';"
+        ],
+        ids=[0, 1, 2, _QUOTE_BREAK_ID],
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST] * 4
+    )
+    return db
+
+_UNSAFE_SQL_DB = _compile_unsafe_sql_db()
+# Hyperscan scratch space must not be shared between threads
+_hyperscan_local = threading.local()
+
+def find_unsafe_sql(sql: str, quote_break: bool = False) -> Optional[str]:
+    """
+    Return the leftmost dangerous keyword or comment marker in sql, or None
+    With quote_break, a quote closing a literal before a new statement counts too
+    """
+    if _UNSAFE_SQL_DB is None:
+        match = (_UNSAFE_SQL_RE if quote_break else _DANGEROUS_SQL_RE).search(sql)
+        return match.group() if match else None
+    
+    scratch = getattr(_hyperscan_local, 'scratch', None)
+    if scratch is None:
+        scratch = _hyperscan_local.scratch = hyperscan.Scratch(_UNSAFE_SQL_DB)
+    
+    data = sql.encode('utf-8', 'surrogatepass')
+    matches = []
+    
+    def on_match(pattern_id, start, end, flags, context):
+        if quote_break or pattern_id != _QUOTE_BREAK_ID:
+            matches.append((start, end))
+    
+    _UNSAFE_SQL_DB.scan(data, match_event_handler=on_match, scratch=scratch)
+    if not matches:
+        return None
+    start, end = min(matches)
+    return data[start:end].decode('utf-8', 'surrogatepass')
+
+# A table named after FROM that is not an allowed table; group 1 is set when
+# the FROM sits inside a function call such as EXTRACT(EPOCH FROM ...) rather
+# than a query or subquery. Allowed names are matched in ASCII case only, as
+# str.lower() would
+_UNKNOWN_TABLE_RE = re.compile(
+    r'(\((?:(?!\bSELECT\b)[^()])*?)?\bFROM\s+"?'
+    r'(?!(?a:' + '|'.join(map(re.escape, ALLOWED_TABLES)) + r')(?![A-Za-z0-9_$]))'
+    r'([A-Za-z_][A-Za-z0-9_$]*)',
+    re.IGNORECASE
+)
+
+# Plain trip counts the template path may answer. Every word of the question
+# must be on the allow list; anything else, negations included, goes to the LLM
+_TEMPLATE_SUBJECT_RE = re.compile(r"^\s*how many\b.*\b(?:trips?|rides?|journeys?)\b", re.IGNORECASE | re.DOTALL)
+_TEMPLATE_WORD_RE = re.compile(r"[^\W_]+(?:['’-][^\W_]+)*")
+_TEMPLATE_NEGATION_RE = re.compile(
+    r"\b(?:not|no|never|excluding|exclude|except|without|other than)\b|n['’]t\b",
+    re.IGNORECASE
+)
+_TEMPLATE_WEEKDAY_WORDS = frozenset({'weekday', 'weekdays', 'weekend', 'weekends'})
+_TEMPLATE_GENDER_WORDS = frozenset({
+    'women', 'woman', 'female', 'females', 'men', 'man', 'male', 'males'
+})
+_TEMPLATE_WORDS = _TEMPLATE_WEEKDAY_WORDS | _TEMPLATE_GENDER_WORDS | frozenset({
+    'how', 'many', 'trip', 'trips', 'ride', 'rides', 'journey', 'journeys',
+    'rider', 'riders', 'a', 'the', 'on', 'there', 'did', 'do', 'does', 'were',
+    'was', 'are', 'is', 'have', 'has', 'had', 'been', 'take', 'taken', 'took',
+    'make', 'made', 'happen', 'happened'
+})
+# Entities the template has no filter for, and the time periods it expresses
+_TEMPLATE_UNMAPPED_ENTITIES = (
+    'numbers', 'dates', 'locations', 'people', 'organizations',
+    'weather_conditions', 'filters', 'measurements'
+)
+_TEMPLATE_TIME_PERIODS = frozenset({'weekday', 'weekend'})
+_TEMPLATE_GENDER_FILTERS = {
+    "rider_gender = 'female'": 'female',
+    "rider_gender = 'male'": 'male'
+}
+
+
+def normalize_sql_cache_key(question: str) -> str:
+    """Normalize a question for exact-match SQL caching"""
+    return ' '.join(unicodedata.normalize('NFKC', question).lower().split())
+
+
+# Hyphen look-alikes an LLM may emit; folded to an ASCII hyphen after NFKC
+_HYPHEN_FOLD = str.maketrans(dict.fromkeys('\u00ad\u2010\u2011\u2012\u2013\u2014\u2212\ufe63', '-'))
+
+
+def _bike_model_key(value: str) -> str:
+    """Canonical lookup key for a bike model spelling"""
+    return unicodedata.normalize('NFKC', value).lower().translate(_HYPHEN_FOLD)
+
+
+# Bike model spellings mapped to the names stored in the database;
+# E‑Bike and Step‑Thru use the non-breaking hyphen U+2011
+_BIKE_MODEL_LUT = {
+    _bike_model_key(spelling): model
+    for spelling, model in {
+        'E-Bike': 'E\u2011Bike',
+        'electric': 'E\u2011Bike',
+        'Step-Thru': 'Step\u2011Thru',
+        'Classic': 'Classic'
+    }.items()
+}
+
+
+def _freeze_json(value: Any) -> Any:
+    """Hashable form of a JSON-like value; dicts become ('{', sorted items), lists ('[', items)"""
+    if isinstance(value, dict):
+        return ('{', tuple(sorted((key, _freeze_json(item)) for key, item in value.items())))
+    if isinstance(value, (list, tuple)):
+        return ('[', tuple(_freeze_json(item) for item in value))
+    return value
+
+
+def _thaw_json(frozen: Any) -> Any:
+    """Inverse of _freeze_json"""
+    if isinstance(frozen, tuple):
+        kind, items = frozen
+        if kind == '{':
+            return {key: _thaw_json(item) for key, item in items}
+        return [_thaw_json(item) for item in items]
+    return frozen
+
+
+@lru_cache(maxsize=1024)
+def _dump_prompt_json(frozen: Any) -> str:
+    """Indented JSON for a frozen value; recurring questions reuse the text"""
+    return orjson.dumps(_thaw_json(frozen), option=orjson.OPT_INDENT_2).decode()
+
+
+# OpenAI clients shared by every QueryGenerator, created on first use. An
+# httpx.AsyncClient's connections belong to the event loop that opened them,
+# so async clients are kept per loop and dropped with it
+_OPENAI_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+_OPENAI_TIMEOUT = 30.0
+_OPENAI_MAX_RETRIES = 2
+_openai_client: Optional[OpenAI] = None
+_async_openai_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_openai_lock = threading.Lock()
+
+
+def get_openai_client() -> OpenAI:
+    """Return the shared OpenAI client"""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(
+                    api_key=os.environ.get("OPENAI_API_KEY", "default_key"),
+                    max_retries=_OPENAI_MAX_RETRIES,
+                    http_client=httpx.Client(limits=_OPENAI_LIMITS, timeout=_OPENAI_TIMEOUT)
+                )
+    return _openai_client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """Return the AsyncOpenAI client of the running event loop; call from a coroutine"""
+    loop = asyncio.get_running_loop()
+    with _openai_lock:
+        client = _async_openai_clients.get(loop)
+        if client is None:
+            client = _async_openai_clients[loop] = AsyncOpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY", "default_key"),
+                max_retries=_OPENAI_MAX_RETRIES,
+                http_client=httpx.AsyncClient(limits=_OPENAI_LIMITS, timeout=_OPENAI_TIMEOUT)
             )
+    return client
+
+
+class _SQLFieldScanner:
+    """
+    Pulls the "sql" string out of a JSON completion as it streams in
+    Each delta is scanned once, so the work stays linear in the response length
+    """
+    
+    _START_RE = re.compile(r'"sql"\s*:\s*"')
+    
+    def __init__(self):
+        self._head = ''
+        self._pending = ''
+        self.parts: List[str] = []
+        self.started = False
+        self.done = False
+    
+    def feed(self, delta: str) -> bool:
+        """Consume a delta; return True when more of the SQL was decoded"""
+        if self.done:
+            return False
+        if not self.started:
+            self._head += delta
+            match = self._START_RE.search(self._head)
+            if match is None:
+                # Keep a tail in case the key is split across deltas
+                self._head = self._head[-32:]
+                return False
+            self.started = True
+            delta = self._head[match.end():]
+            self._head = ''
+        
+        raw = self._pending + delta
+        i, n = 0, len(raw)
+        while i < n:
+            char = raw[i]
+            if char == '\\':
+                width = 6 if raw[i + 1:i + 2] == 'u' else 2
+                if i + width > n:
+                    # The escape continues in the next delta
+                    break
+                i += width
+            elif char == '"':
+                self.done = True
+                break
+            else:
+                i += 1
+        self._pending = '' if self.done else raw[i:]
+        if not i:
+            return False
+        self.parts.append(json.loads('"' + raw[:i] + '"'))
+        return True
+
+
+class QueryGenerator:
+    """Generates SQL queries from natural language using LLM"""
+    
+    def __init__(self, db_manager: DatabaseManager, semantic_mapper: SemanticMapper):
+        self.db_manager = db_manager
+        self.semantic_mapper = semantic_mapper
+        # Clients are shared process-wide so instances reuse warm connections;
+        # the async client comes from the running event loop unless one is set here
+        self.openai_client = get_openai_client()
+        self.async_openai_client: Optional[AsyncOpenAI] = None
+        # Generated SQL keyed by normalized question, least recently used first
+        self._sql_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sql_cache_size = int(os.getenv('SQL_CACHE_SIZE', 512))
+        self._sql_cache_lock = threading.Lock()
+        # Last formatted schema as (schema_info, text)
+        self._schema_text = None
+        # System prompts keyed by (schema text, response format)
+        self._system_prompts: Dict[Tuple[str, str], str] = {}
+        # Concurrent requests are coalesced into one multi-question LLM call
+        # Callers give up once every attempt of the flush's LLM call could have timed out
+        max_wait = int(os.getenv('LLM_BATCH_WAIT_MS', 25)) / 1000
+        self._batcher = RequestBatcher(
+            self._generate_sql_batch_with_llm,
+            max_batch_size=int(os.getenv('LLM_BATCH_SIZE', 8)),
+            max_wait=max_wait,
+            timeout=_OPENAI_TIMEOUT * (_OPENAI_MAX_RETRIES + 1) + max_wait
+        )
+    
+    def generate_query(self, question: str, entities: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Generate SQL query from natural language question and extracted entities
+        Returns: {"sql": str, "params": list, "error": str or None}
+        """
+        cache_key = normalize_sql_cache_key(question)
+        cached = self._get_cached_sql(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            # Get semantic mappings for the question
+            schema_info = self.db_manager.get_schema_info()
+            semantic_mappings = self.semantic_mapper.map_entities_to_schema(question, entities, schema_info)
             
-            content = response.choices[0].message.content
-            if content is None:
-                return {
-                    "sql": None,
-                    "params": [],
-                    "error": "LLM returned empty response"
-                }
-            result = json.loads(content)
-            
-            # Check if LLM returned an error for irrelevant questions
-            if result.get('error'):
-                return {
-                    "sql": None,
-                    "params": [],
-                    "error": result['error']
-                }
-            
-            # Validate the response
-            if not result.get('sql'):
-                return {
-                    "sql": None,
-                    "params": [],
-                    "error": "LLM failed to generate SQL query"
-                }
+            # Simple counts are assembled locally without an LLM call
+            sql_result = self._try_template_sql(question, entities, semantic_mappings)
             
-            # Validate SQL query safety
-            sql_validation = self._validate_sql_safety(result['sql'])
-            if not sql_validation['safe']:
-                logging.error(f"SQL validation failed: {sql_validation['error']}")
-                logging.error(f"Generated SQL: {result['sql']}")
-                return {
-                    "sql": None,
-                    "params": [],
-                    "error": "Sorry, I couldn't process your question. Please try asking about bike trips, station usage, or weather data."
-                }
+            if sql_result is None:
+                # Get schema information, already formatted for the prompt
+                schema_description = self._format_schema_for_llm(schema_info)
+                
+                # Generate SQL using LLM
+                try:
+                    sql_result = self._batcher.submit((question, entities, schema_description, semantic_mappings))
+                except TimeoutError:
+                    logging.error(f"LLM query generation timed out after {self._batcher.timeout}s")
+                    return self._llm_failure()
             
-            # Normalize bike model parameters to handle Unicode characters
-            normalized_params = self._normalize_bike_model_params(result.get('params', []))
+            self._cache_sql(cache_key, sql_result)
+            return sql_result
             
+        except Exception as e:
+            logging.error(f"Query generation failed: {e}")
             return {
-                "sql": result['sql'],
-                "params": normalized_params,
-                "error": None
+                "sql": None,
+                "params": [],
+                "error": f"Query generation error: {str(e)}"
             }
+    
+    def _get_cached_sql(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached result for a question, or None"""
+        with self._sql_cache_lock:
+            cached = self._sql_cache.get(cache_key)
+            if cached is None:
+                return None
+            self._sql_cache.move_to_end(cache_key)
+        return {**cached, "params": list(cached["params"])}
+    
+    def _cache_sql(self, cache_key: str, sql_result: Dict[str, Any]):
+        """Remember a successful result, evicting the least recently used one when full"""
+        if sql_result.get('error') or not sql_result.get('sql') or self._sql_cache_size <= 0:
+            return
+        with self._sql_cache_lock:
+            self._sql_cache[cache_key] = {**sql_result, "params": list(sql_result.get('params', []))}
+            self._sql_cache.move_to_end(cache_key)
+            while len(self._sql_cache) > self._sql_cache_size:
+                self._sql_cache.popitem(last=False)
+    
+    def _try_template_sql(self, question: str, entities: Dict[str, Any],
+                          mappings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Build SQL for plain trip counts without the LLM
+        Only questions whose meaning the mappings capture completely qualify:
+        a COUNT over trips filtered by weekday/weekend and at most one gender,
+        worded with nothing but _TEMPLATE_WORDS. Anything else returns None
+        """
+        if not _TEMPLATE_SUBJECT_RE.search(question) or _TEMPLATE_NEGATION_RE.search(question):
+            return None
+        words = set(_TEMPLATE_WORD_RE.findall(question.lower()))
+        if not words <= _TEMPLATE_WORDS:
+            return None
+        if any(entities.get(key) for key in _TEMPLATE_UNMAPPED_ENTITIES):
+            return None
+        if not _TEMPLATE_TIME_PERIODS.issuperset(entities.get('time_periods', [])):
+            return None
+        if any(demographic.get('type') != 'gender' for demographic in entities.get('demographics', [])):
+            return None
+        if mappings.get('aggregations', {}).get('function') != ['COUNT']:
+            return None
+        if set(mappings.get('tables', {})) != {'trips'} or mappings.get('columns', {}).get('name'):
+            return None
+        if mappings.get('date_filters', {}).get('condition'):
+            return None
+        
+        conditions, params = [], []
+        genders = set()
+        for condition in mappings.get('filters', {}).get('condition', []):
+            gender = _TEMPLATE_GENDER_FILTERS.get(condition)
+            if gender is not None:
+                genders.add(gender)
+            elif condition.startswith('EXTRACT(ISODOW FROM started_at)'):
+                if condition not in conditions:
+                    conditions.append(condition)
+            else:
+                return None
+        if len(genders) > 1:
+            return None
+        # Every weekday or gender term must have produced its filter
+        if words & _TEMPLATE_WEEKDAY_WORDS and not conditions:
+            return None
+        if words & _TEMPLATE_GENDER_WORDS and not genders:
+            return None
+        for gender in genders:
+            conditions.append("rider_gender = %s")
+            params.append(gender)
+        
+        sql = "SELECT COUNT(*) AS trip_count FROM trips"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return {
+            "sql": sql,
+            "params": params,
+            "error": None
+        }
+    
+    def invalidate_schema(self):
+        """Drop the cached schema, e.g. after a migration"""
+        self.db_manager.invalidate_schema()
+    
+    def lookup_faq(self, question: str) -> Optional[Dict[str, Any]]:
+        """Return precomputed SQL for a frequently asked question, or None"""
+        faq = FAQ_QUERIES.get(normalize_question(question).rstrip('?.! '))
+        if faq is None:
+            return None
+        return {
+            "sql": faq["sql"],
+            "params": list(faq["params"]),
+            "error": None
+        }
+    
+    def _generate_sql_with_llm(self, question: str, entities: Dict[str, Any], 
+                               schema_description: str, 
+                               semantic_mappings: Dict[str, Any]) -> Dict[str, Any]:
+        """Use OpenAI GPT-4o to generate SQL query"""
+        system_prompt = self._get_system_prompt(schema_description, SINGLE_RESPONSE_FORMAT)
+        user_prompt = self._build_user_prompt(question, entities, semantic_mappings)
+
+        try:
+            content = self._request_completion(system_prompt, user_prompt)
+            return self._parse_completion(content)
             
         except Exception as e:
             logging.error(f"LLM query generation failed: {e}")
+            return self._llm_failure()
+    
+    async def generate_query_async(self, question: str, entities: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Async version of generate_query that awaits the LLM instead of blocking
+        Schema lookup and semantic mapping run in worker threads
+        """
+        cache_key = normalize_sql_cache_key(question)
+        cached = self._get_cached_sql(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            schema_info = await asyncio.to_thread(self.db_manager.get_schema_info)
+            semantic_mappings = await asyncio.to_thread(
+                self.semantic_mapper.map_entities_to_schema, question, entities, schema_info
+            )
+            schema_description = self._format_schema_for_llm(schema_info)
+            
+            sql_result = self._try_template_sql(question, entities, semantic_mappings)
+            if sql_result is None:
+                system_prompt = self._get_system_prompt(schema_description, SINGLE_RESPONSE_FORMAT)
+                user_prompt = self._build_user_prompt(question, entities, semantic_mappings)
+                
+                try:
+                    content = await self._request_completion_async(system_prompt, user_prompt)
+                    sql_result = self._parse_completion(content)
+                except Exception as e:
+                    logging.error(f"LLM query generation failed: {e}")
+                    return self._llm_failure()
+            
+            self._cache_sql(cache_key, sql_result)
+            return sql_result
+            
+        except Exception as e:
+            logging.error(f"Query generation failed: {e}")
             return {
                 "sql": None,
                 "params": [],
-                "error": "Sorry, I couldn't understand your question. Please try asking about bike trips, stations, or weather data."
+                "error": f"Query generation error: {str(e)}"
             }
     
-    def _normalize_bike_model_params(self, params: List[Any]) -> List[Any]:
-        """Normalize bike model parameters to handle Unicode characters properly"""
-        normalized_params = []
+    async def generate_query_stream(self, question: str,
+                                    entities: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate SQL while the completion streams in
+        Yields {"partial_sql": str} each time more of the SQL arrives, then
+        {"result": <query result>} once; unsafe SQL ends the stream early
+        """
+        cache_key = normalize_sql_cache_key(question)
+        cached = self._get_cached_sql(cache_key)
+        if cached is not None:
+            yield {"result": cached}
+            return
         
-        # Define the correct Unicode bike model mappings
-        bike_model_map = {
-            'E-Bike': 'E‑Bike',      # ASCII hyphen → Unicode U+2011
-            'e-bike': 'E‑Bike',
-            'electric': 'E‑Bike',
-            'Step-Thru': 'Step‑Thru',  # ASCII hyphen → Unicode U+2011
-            'step-thru': 'Step‑Thru',
-            'Classic': 'Classic'        # No change needed
-        }
+        try:
+            schema_info = await asyncio.to_thread(self.db_manager.get_schema_info)
+            semantic_mappings = await asyncio.to_thread(
+                self.semantic_mapper.map_entities_to_schema, question, entities, schema_info
+            )
+            schema_description = self._format_schema_for_llm(schema_info)
+        except Exception as e:
+            logging.error(f"Query generation failed: {e}")
+            yield {"result": {
+                "sql": None,
+                "params": [],
+                "error": f"Query generation error: {str(e)}"
+            }}
+            return
+        
+        sql_result = self._try_template_sql(question, entities, semantic_mappings)
+        if sql_result is not None:
+            self._cache_sql(cache_key, sql_result)
+            yield {"result": sql_result}
+            return
         
-        for param in params:
-            if isinstance(param, str):
-                # Check if this parameter is a bike model that needs normalization
-                normalized_param = bike_model_map.get(param, param)
-                # Also handle case variations
-                for ascii_name, unicode_name in bike_model_map.items():
-                    if param.lower() == ascii_name.lower():
-                        normalized_param = unicode_name
-                        break
-                normalized_params.append(normalized_param)
+        system_prompt = self._get_system_prompt(schema_description, SINGLE_RESPONSE_FORMAT)
+        user_prompt = self._build_user_prompt(question, entities, semantic_mappings)
+        
+        chunks: List[str] = []
+        scanner = _SQLFieldScanner()
+        # Keyword matches can straddle deltas, so each check re-reads a short overlap
+        checked = 0
+        parsed = None
+        try:
+            response = await self._async_client().chat.completions.create(
+                **self._completion_args(system_prompt, user_prompt, stream=True)
+            )
+            try:
+                async for chunk in response:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    chunks.append(delta)
+                    
+                    if scanner.feed(delta):
+                        partial_sql = "".join(scanner.parts)
+                        if find_unsafe_sql(partial_sql[max(checked - 8, 0):]):
+                            logging.error(f"Streamed SQL rejected: {partial_sql}")
+                            yield {"result": self._parse_sql_response({"sql": partial_sql})}
+                            return
+                        checked = len(partial_sql)
+                        yield {"partial_sql": partial_sql}
+                    
+                    # Only a closing brace can end the JSON object
+                    if delta.rstrip().endswith('}'):
+                        try:
+                            parsed = json.loads("".join(chunks))
+                            break
+                        except ValueError:
+                            pass
+            finally:
+                await response.close()
+            
+            if parsed is None:
+                sql_result = self._parse_completion("".join(chunks) if chunks else None)
             else:
-                normalized_params.append(param)
+                sql_result = self._parse_sql_response(parsed)
+        except Exception as e:
+            logging.error(f"LLM query generation failed: {e}")
+            yield {"result": self._llm_failure()}
+            return
         
-        return normalized_params
+        self._cache_sql(cache_key, sql_result)
+        yield {"result": sql_result}
     
-    def _validate_sql_safety(self, sql: str) -> Dict[str, Any]:
-        """Validate that the SQL query is safe and appropriate"""
-        sql_upper = sql.upper().strip()
+    async def generate_query_batch(self, items: List[Tuple[str, Dict[str, Any]]],
+                                   max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Generate SQL for many (question, entities) pairs concurrently
+        At most max_concurrency LLM calls are in flight; results keep the input order
+        """
+        # Created per call: an asyncio.Semaphore is tied to the running event loop
+        semaphore = asyncio.Semaphore(max_concurrency or int(os.getenv('LLM_MAX_CONCURRENCY', 5)))
         
-        # Check for dangerous operations
-        dangerous_keywords = ['DELETE', 'UPDATE', 'INSERT', 'DROP', 'ALTER', 'TRUNCATE', 'CREATE']
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                return {
-                    "safe": False,
-                    "error": f"Query contains unsafe operation: {keyword}. Only SELECT queries are allowed."
+        async def generate_one(question: str, entities: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.generate_query_async(question, entities)
+        
+        return await asyncio.gather(*(generate_one(question, entities) for question, entities in items))
+    
+    async def generate_queries_multi(self, qas: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Generate SQL for several independent questions with a single LLM call
+        Cached and template questions are answered without the LLM; a single
+        remaining question uses the regular single-question prompt.
+        Results keep the input order
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(qas)
+        cache_keys = [normalize_sql_cache_key(question) for question, _ in qas]
+        pending = []
+        for i, cache_key in enumerate(cache_keys):
+            results[i] = self._get_cached_sql(cache_key)
+            if results[i] is None:
+                pending.append(i)
+        if not pending:
+            return results
+        
+        try:
+            schema_info = await asyncio.to_thread(self.db_manager.get_schema_info)
+            all_mappings = await asyncio.gather(*(
+                asyncio.to_thread(self.semantic_mapper.map_entities_to_schema, qas[i][0], qas[i][1], schema_info)
+                for i in pending
+            ))
+        except Exception as e:
+            logging.error(f"Query generation failed: {e}")
+            for i in pending:
+                results[i] = {
+                    "sql": None,
+                    "params": [],
+                    "error": f"Query generation error: {str(e)}"
                 }
+            return results
         
-        # Simple table validation - only check main FROM clause (not functions)
-        allowed_tables = ['bikes', 'trips', 'stations', 'daily_weather']
+        llm_items = []
+        for i, semantic_mappings in zip(pending, all_mappings):
+            results[i] = self._try_template_sql(qas[i][0], qas[i][1], semantic_mappings)
+            if results[i] is None:
+                llm_items.append((i, semantic_mappings))
         
-        # Much simpler approach: split by keywords and check what follows FROM
-        sql_words = sql_upper.split()
+        if llm_items:
+            schema_description = self._format_schema_for_llm(schema_info)
+            single = len(llm_items) == 1
+            system_prompt = self._get_system_prompt(
+                schema_description, SINGLE_RESPONSE_FORMAT if single else BATCH_RESPONSE_FORMAT
+            )
+            if single:
+                i, semantic_mappings = llm_items[0]
+                user_prompt = self._build_user_prompt(qas[i][0], qas[i][1], semantic_mappings)
+            else:
+                user_prompt = self._build_batch_user_prompt(
+                    [(qas[i][0], qas[i][1], semantic_mappings) for i, semantic_mappings in llm_items]
+                )
+            
+            try:
+                content = await self._request_completion_async(system_prompt, user_prompt)
+                if single:
+                    generated = [self._parse_completion(content)]
+                else:
+                    generated = self._parse_batch_completion(content, len(llm_items))
+            except Exception as e:
+                logging.error(f"Batched LLM query generation failed: {e}")
+                generated = [self._llm_failure() for _ in llm_items]
+            
+            for (i, _), sql_result in zip(llm_items, generated):
+                results[i] = sql_result
         
-        # Find main table references after FROM (avoiding function contexts)
-        for i, word in enumerate(sql_words):
-            if word == 'FROM' and i + 1 < len(sql_words):
-                # Check if this FROM is not inside a function call
-                # Look back to see if we're inside parentheses
-                context_before = ' '.join(sql_words[max(0, i-3):i])
-                
-                # Skip if this FROM appears to be inside a function (has parentheses before it)
-                if '(' in context_before and ')' not in context_before:
-                    continue
-                    
-                next_word = sql_words[i + 1].lower().strip('(),;')
-                if next_word not in allowed_tables and not next_word.startswith('('):
-                    return {
-                        "safe": False,
-                        "error": f"Query references unknown table '{next_word}'. Available tables: {', '.join(allowed_tables)}"
-                    }
+        for i in pending:
+            self._cache_sql(cache_keys[i], results[i])
+        return results
+    
+    def _build_user_prompt(self, question: str, entities: Dict[str, Any],
+                           semantic_mappings: Dict[str, Any]) -> str:
+        """Build the user message for a single question"""
+        # Everything question-specific goes in the user message so the system
+        # prompt stays byte-identical and OpenAI can reuse its cached prefix
+        return f"""
+Convert this natural language question to SQL:
+"{question}"
+
+Extracted entities: {_dump_prompt_json(_freeze_json(entities))}
+
+Semantic mappings: {_dump_prompt_json(_freeze_json(semantic_mappings))}
+
+Focus on:
+1. Identifying the main metric requested (count, average, sum, etc.)
+2. Applying appropriate filters based on entities
+3. Joining tables as needed
+4. Using parameterized queries for safety
+"""
+    
+    def _generate_sql_batch_with_llm(self, items: List[Tuple[str, Dict[str, Any], str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Generate SQL for several questions with a single LLM call
+        Each item is (question, entities, schema_description, semantic_mappings);
+        a batch of one uses the regular single-question prompt
+        """
+        if len(items) == 1:
+            return [self._generate_sql_with_llm(*items[0])]
         
-        return {"safe": True, "error": None}
+        # All items come from the same database, so the schema is shared
+        schema_description = items[0][2]
+        system_prompt = self._get_system_prompt(schema_description, BATCH_RESPONSE_FORMAT)
+        user_prompt = self._build_batch_user_prompt(
+            [(question, entities, semantic_mappings) for question, entities, _, semantic_mappings in items]
+        )
+
+        try:
+            content = self._request_completion(system_prompt, user_prompt)
+            return self._parse_batch_completion(content, len(items))
+        except Exception as e:
+            logging.error(f"Batched LLM query generation failed: {e}")
+            return [self._llm_failure() for _ in items]
     
-    def _format_schema_for_llm(self, schema_info: Dict[str, Any]) -> str:
-        """Format schema information for LLM consumption"""
-        schema_text = ""
+    def _build_batch_user_prompt(self, items: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> str:
+        """Build the user message for several (question, entities, semantic_mappings) items"""
+        questions = [
+            {"id": i, "question": question, "entities": entities, "semantic_mappings": semantic_mappings}
+            for i, (question, entities, semantic_mappings) in enumerate(items)
+        ]
+        return f"""
+Convert each of these natural language questions to SQL independently:
+{orjson.dumps(questions, option=orjson.OPT_INDENT_2).decode()}
+
+For each question focus on:
+1. Identifying the main metric requested (count, average, sum, etc.)
+2. Applying appropriate filters based on its entities and semantic mappings
+3. Joining tables as needed
+4. Using parameterized queries for safety
+"""
+    
+    def _parse_batch_completion(self, content: Optional[str], count: int) -> List[Dict[str, Any]]:
+        """Turn the raw LLM content for a batch into one query result per question"""
+        results = json.loads(content).get('results', []) if content else []
+        results_by_id = {r.get('id'): r for r in results if isinstance(r, dict)}
+        return [self._parse_sql_response(results_by_id.get(i, {})) for i in range(count)]
+    
+    def _get_system_prompt(self, schema_description: str, response_format: str) -> str:
+        """Return the system prompt for a schema, building it once per schema"""
+        key = (schema_description, response_format)
+        system_prompt = self._system_prompts.get(key)
+        if system_prompt is None:
+            # A new schema replaces every prompt built for the old one
+            if any(cached_schema != schema_description for cached_schema, _ in self._system_prompts):
+                self._system_prompts = {}
+            system_prompt = self._build_system_prompt(schema_description, response_format)
+            self._system_prompts[key] = system_prompt
+        return system_prompt
+    
+    def _build_system_prompt(self, schema_description: str, response_format: str) -> str:
+        """Fill the system prompt template for a schema and response format"""
+        return _SYSTEM_PROMPT_TEMPLATE.format(schema=schema_description, response_format=response_format)
+    
+    def _completion_args(self, system_prompt: str, user_prompt: str, **kwargs) -> Dict[str, Any]:
+        """Arguments shared by every chat completion request"""
+        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+        # do not change this unless explicitly requested by the user
+        return dict(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.1,
+            **kwargs
+        )
+    
+    def _request_completion(self, system_prompt: str, user_prompt: str) -> Optional[str]:
+        """Send the prompts to the LLM and return the raw JSON content"""
+        response = self.openai_client.chat.completions.create(
+            **self._completion_args(system_prompt, user_prompt, stream=True)
+        )
+        chunks: List[str] = []
+        for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                chunks.append(delta)
+        return "".join(chunks) if chunks else None
+    
+    def _async_client(self) -> AsyncOpenAI:
+        """Return the async OpenAI client to use on the running event loop"""
+        return self.async_openai_client if self.async_openai_client is not None else get_async_openai_client()
+    
+    async def _request_completion_async(self, system_prompt: str, user_prompt: str) -> Optional[str]:
+        """Async version of _request_completion"""
+        response = await self._async_client().chat.completions.create(
+            **self._completion_args(system_prompt, user_prompt)
+        )
+        return response.choices[0].message.content
+    
+    def _parse_completion(self, content: Optional[str]) -> Dict[str, Any]:
+        """Turn the raw LLM content for one question into a query result"""
+        if content is None:
+            return {
+                "sql": None,
+                "params": [],
+                "error": "LLM returned empty response"
+            }
+        return self._parse_sql_response(json.loads(content))
+    
+    def _parse_sql_response(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate one LLM answer and turn it into a query result"""
+        # Check if LLM returned an error for irrelevant questions
+        if result.get('error'):
+            return {
+                "sql": None,
+                "params": [],
+                "error": result['error']
+            }
         
-        for table_name, table_info in schema_info.items():
-            schema_text += f"\nTable: {table_name}\n"
-            schema_text += "Columns:\n"
-            
-            for column in table_info['columns']:
-                schema_text += f"  - {column['name']} ({column['type']})"
-                if not column['nullable']:
-                    schema_text += " NOT NULL"
-                if column['key_type'] == 'PRIMARY KEY':
-                    schema_text += " PRIMARY KEY"
-                schema_text += "\n"
-            
-            if table_info['foreign_keys']:
-                schema_text += "Foreign Keys:\n"
-                for fk in table_info['foreign_keys']:
-                    schema_text += f"  - {fk['column']} -> {fk['references_table']}.{fk['references_column']}\n"
+        # Validate the response
+        if not result.get('sql'):
+            return {
+                "sql": None,
+                "params": [],
+                "error": "LLM failed to generate SQL query"
+            }
         
-        return schema_text
+        # Validate SQL query safety
+        sql_validation = self._validate_sql_safety(result['sql'])
+        if not sql_validation['safe']:
+            logging.error(f"SQL validation failed: {sql_validation['error']}")
+            logging.error(f"Generated SQL: {result['sql']}")
+            return {
+                "sql": None,
+                "params": [],
+                "error": "Sorry, I couldn't process your question. Please try asking about bike trips, station usage, or weather data."
+            }
+        
+        # Normalize bike model parameters to handle Unicode characters
+        normalized_params = self._normalize_bike_model_params(result.get('params', []))
+        
+        return {
+            "sql": result['sql'],
+            "params": normalized_params,
+            "error": None
+        }
+    
+    def _llm_failure(self) -> Dict[str, Any]:
+        """Result returned when the LLM call itself fails"""
+        return {
+            "sql": None,
+            "params": [],
+            "error": "Sorry, I couldn't understand your question. Please try asking about bike trips, stations, or weather data."
+        }
+    
+    def _normalize_bike_model_params(self, params: List[Any]) -> List[Any]:
+        """Normalize bike model parameters to handle Unicode characters properly"""
+        return [_BIKE_MODEL_LUT.get(_bike_model_key(param), param) if isinstance(param, str) else param for param in params]
+    
+    def _validate_sql_safety(self, sql: str) -> Dict[str, Any]:
+        """Validate that the SQL query is safe and appropriate"""
+        # Check for dangerous operations
+        unsafe = find_unsafe_sql(sql)
+        if unsafe:
+            return {
+                "safe": False,
+                "error": f"Query contains unsafe operation: {unsafe.upper()}. Only SELECT queries are allowed."
+            }
+        
+        # Simple table validation - only check FROM clauses (not functions)
+        for match in _UNKNOWN_TABLE_RE.finditer(sql):
+            if match.group(1) is not None:
+                continue
+            return {
+                "safe": False,
+                "error": f"Query references unknown table '{match.group(2).lower()}'. Available tables: {', '.join(ALLOWED_TABLES)}"
+            }
+        
+        return {"safe": True, "error": None}
+    
+    def _format_schema_for_llm(self, schema_info: Dict[str, Any]) -> str:
+        """Format schema information for LLM consumption, reusing the text for an unchanged schema"""
+        if self._schema_text is None or self._schema_text[0] is not schema_info:
+            self._schema_text = (schema_info, format_schema_prompt(schema_info))
+        return self._schema_text[1]
     
     def validate_sql_safety(self, sql: str) -> bool:
         """
@@ -288,24 +957,10 @@ Focus on:
         Returns True if safe, False otherwise
         """
         # Check for dangerous patterns
-        dangerous_patterns = [
-            r"';",  # SQL injection attempt
-            r"--",  # SQL comments
-            r"/\*",  # Multi-line comments
-            r"UNION",  # Union attacks
-            r"DROP",  # DDL statements
-            r"DELETE",  # DML without WHERE (should be caught by business logic)
-            r"UPDATE",  # DML without WHERE
-            r"INSERT",  # DML statements
-            r"CREATE",  # DDL statements
-            r"ALTER",   # DDL statements
-        ]
-        
-        sql_upper = sql.upper()
-        for pattern in dangerous_patterns:
-            if pattern in sql_upper:
-                logging.warning(f"Potentially unsafe SQL pattern detected: {pattern}")
-                return False
+        unsafe = find_unsafe_sql(sql, quote_break=True)
+        if unsafe:
+            logging.warning(f"Potentially unsafe SQL pattern detected: {unsafe}")
+            return False
         
         # Ensure query uses parameterized format (%s)
         if "'" in sql and "%s" not in sql:
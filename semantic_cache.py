@@ -0,0 +1,146 @@
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+# Maps question text to an embedding vector
+Embedder = Callable[[str], List[float]]
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase and collapse whitespace so trivially different questions share a key"""
+    return ' '.join(question.lower().split())
+
+
+def entity_signature(entities: Dict[str, Any]) -> FrozenSet[str]:
+    """Flatten extracted entities into a set of 'category:value' strings"""
+    signature = set()
+    for category, values in entities.items():
+        for value in values:
+            if isinstance(value, dict):
+                value = ':'.join(str(v) for v in value.values())
+            signature.add(f"{category}:{value}")
+    return frozenset(signature)
+
+
+def openai_embedder(client, model: str = "text-embedding-3-small", dimensions: int = 256) -> Embedder:
+    """
+    Build an embedder backed by the OpenAI embeddings API
+    Short vectors keep the pure-Python similarity scan cheap
+    """
+    # A cache lookup must never cost more than the LLM call it is trying to save
+    client = client.with_options(max_retries=0, timeout=5.0)
+
+    def embed(text: str) -> List[float]:
+        response = client.embeddings.create(model=model, input=text, dimensions=dimensions)
+        return response.data[0].embedding
+
+    return embed
+
+
+class SemanticCache:
+    """
+    LRU cache of generated SQL keyed by question meaning
+    A question is served from the cache when it matches a previous one exactly,
+    or when its extracted entities are identical and its embedding is close
+    enough that the same SQL answers it. Questions are only embedded when a
+    cached entry shares their entities, so a plain miss costs no embedding call
+    """
+
+    def __init__(self, embedder: Embedder, maxsize: int = 512, similarity_threshold: float = 0.92):
+        self.embedder = embedder
+        self.maxsize = maxsize
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_generate(self, question: str, entities: Dict[str, Any],
+                        generate: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Return cached {"sql", "params", "error"} for the question, calling
+        generate() and caching its result on a miss
+        Only successful generations are cached
+        """
+        if self.maxsize <= 0:
+            return generate()
+
+        key = normalize_question(question)
+        signature = entity_signature(entities)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return dict(entry['sql_result'])
+
+        # SQL depends on every entity, so only entries with the same signature may answer
+        with self._lock:
+            candidates = [(k, e) for k, e in self._entries.items() if e['signature'] == signature]
+
+        vector = None
+        if candidates:
+            vector = self._embed(key)
+            if vector is not None:
+                entry = self._find_similar(vector, candidates)
+                if entry is not None:
+                    logging.debug(f"Semantic cache hit for question: {question}")
+                    return dict(entry['sql_result'])
+
+        sql_result = generate()
+        if not sql_result.get('error') and sql_result.get('sql'):
+            self._store(key, vector, signature, sql_result)
+        return sql_result
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        """Return a unit-length embedding, or None if the embedder fails"""
+        try:
+            vector = self.embedder(text)
+        except Exception as e:
+            logging.warning(f"Question embedding failed, using exact-match cache only: {e}")
+            return None
+        norm = math.sqrt(sum(x * x for x in vector))
+        if not norm:
+            return None
+        return [x / norm for x in vector]
+
+    def _find_similar(self, vector: List[float],
+                      candidates: List[Tuple[str, Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """
+        Find the most similar candidate entry above the similarity threshold
+        Entries stored without a vector are embedded now, once
+        """
+        best_key, best_entry, best_score = None, None, self.similarity_threshold
+        for key, entry in candidates:
+            if entry['vector'] is None:
+                # The key is the normalized question the entry was generated for
+                entry['vector'] = self._embed(key)
+                if entry['vector'] is None:
+                    continue
+            score = sum(a * b for a, b in zip(vector, entry['vector']))
+            if score >= best_score:
+                best_key, best_entry, best_score = key, entry, score
+        if best_key is None:
+            return None
+        with self._lock:
+            if best_key in self._entries:
+                self._entries.move_to_end(best_key)
+        return best_entry
+
+    def _store(self, key: str, vector: Optional[List[float]], signature: FrozenSet[str],
+               sql_result: Dict[str, Any]):
+        """Insert an entry, evicting the least recently used one when full"""
+        with self._lock:
+            self._entries[key] = {
+                'vector': vector,
+                'signature': signature,
+                'sql_result': dict(sql_result)
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
@@ -1,8 +1,61 @@
 import logging
 import re
+from types import MappingProxyType
 from typing import Dict, List, Any, Optional, Tuple
-from difflib import SequenceMatcher
+from rapidfuzz import fuzz, process
 from .database import DatabaseManager
+from .nlp_service import build_keyword_scanner
+
+# Join conditions for each pair of tables that can be joined
+_JOIN_PATTERNS = MappingProxyType({
+    ('trips', 'stations'): (
+        "trips.start_station_id = stations.station_id",
+        "trips.end_station_id = stations.station_id"
+    ),
+    ('trips', 'daily_weather'): (
+        "DATE(trips.started_at) = daily_weather.weather_date",
+    ),
+    ('trips', 'bikes'): (
+        "trips.bike_id = bikes.bike_id",
+    )
+})
+
+# Bike type mentions, one named group per model; each alternative is a lookahead
+# over the whole question, so the first model listed wins wherever it appears
+_BIKE_TYPE_RE = re.compile(
+    r"(?=.*?(?P<ebike>ebikes|e-bikes|electric bikes|electric))"
+    r"|(?=.*?(?P<classic>classic bikes|classic))"
+    r"|(?=.*?(?P<stepthru>step-thru|step thru))",
+    re.IGNORECASE | re.DOTALL
+)
+_BIKE_TYPE_CONDITIONS = {
+    'ebike': "bike_model = 'E‑Bike'",
+    'classic': "bike_model = 'Classic'",
+    'stepthru': "bike_model = 'Step‑Thru'"
+}
+
+# Time period patterns with their date filter and confidence; first match wins
+_TIME_PATTERNS = (
+    (re.compile(r"june 2025", re.IGNORECASE),
+     "DATE_PART('month', started_at) = 6 AND DATE_PART('year', started_at) = 2025", 0.95),
+    (re.compile(r"^(?=.*?first week)(?=.*?june)", re.IGNORECASE | re.DOTALL),
+     "started_at BETWEEN '2025-06-01' AND '2025-06-07'", 0.9),
+    (re.compile(r"last month", re.IGNORECASE),
+     "DATE_PART('month', started_at) = 6 AND DATE_PART('year', started_at) = 2025", 0.8)
+)
+
+# Mapping categories stored as parallel value/confidence lists, with the
+# name of each category's value list
+_MAPPING_FIELDS = MappingProxyType({
+    'columns': 'name',
+    'filters': 'condition',
+    'joins': 'condition',
+    'aggregations': 'function',
+    'date_filters': 'condition'
+})
+
+# Tables a domain concept can map to directly
+DOMAIN_TABLES = ('trips', 'stations', 'bikes', 'daily_weather')
 
 class SemanticMapper:
     """Maps natural language entities to database schema elements"""
@@ -10,6 +63,12 @@ class SemanticMapper:
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
         
+        # Known station names, lowercase for fuzzy matching
+        self._station_names = [
+            'congress avenue', 'barton springs', 'capitol square',
+            'east side', 'river walk'
+        ]
+        
         # Predefined semantic mappings for common bike-share terms
         self.domain_mappings = {
             'time_concepts': {
@@ -67,22 +126,23 @@ class SemanticMapper:
                 'step thru': ["bike_model = 'Step‑Thru'"]
             }
         }
+        self._compile_domain_mappings()
     
-    def map_entities_to_schema(self, question: str, entities: Dict[str, Any]) -> Dict[str, Any]:
+    def map_entities_to_schema(self, question: str, entities: Dict[str, Any],
+                               schema_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Map extracted entities to database schema elements
-        Returns mappings with confidence scores
+        schema_info may be passed by callers that already fetched it
+        Returns mappings with confidence scores: tables maps each name to its
+        confidence, every other category holds parallel lists such as
+        {'condition': [...], 'confidence': [...]}
         """
-        schema_info = self.db_manager.get_schema_info()
+        if schema_info is None:
+            schema_info = self.db_manager.get_schema_info()
         
-        mappings = {
-            'tables': [],
-            'columns': [],
-            'filters': [],
-            'joins': [],
-            'aggregations': [],
-            'date_filters': []
-        }
+        mappings = {'tables': {}}
+        for key, field in _MAPPING_FIELDS.items():
+            mappings[key] = {field: [], 'confidence': []}
         
         # Map based on domain knowledge
         self._apply_domain_mappings(question, mappings)
@@ -101,48 +161,55 @@ class SemanticMapper:
         
         return mappings
     
+    def _compile_domain_mappings(self):
+        """
+        Precompile domain_mappings into a single keyword scanner
+        Each concept's schema elements are classified once here, so a question
+        only needs one scan and a lookup per matched concept
+        """
+        self._domain_entries = []
+        tags_by_concept = {}
+        for category, concepts in self.domain_mappings.items():
+            for concept, schema_elements in concepts.items():
+                tags_by_concept.setdefault(concept, set()).add(len(self._domain_entries))
+                self._domain_entries.append([
+                    mapping
+                    for element in schema_elements
+                    for mapping in self._classify_schema_element(element)
+                ])
+        self._domain_re, self._domain_tags = build_keyword_scanner(tags_by_concept)
+    
+    def _classify_schema_element(self, element: str) -> List[Tuple[str, Any]]:
+        """
+        Resolve a domain schema element into the (mapping key, value, confidence)
+        triples it adds
+        """
+        if element.startswith('station_name =') or element.startswith('rider_gender ='):
+            return [('filters', element, 0.95)]
+        if element.startswith('precipitation_mm'):
+            return [
+                ('filters', element, 0.9),
+                ('tables', 'daily_weather', 0.9)
+            ]
+        if element.startswith('EXTRACT(ISODOW'):
+            return [('filters', element, 0.9)]
+        if element in DOMAIN_TABLES:
+            return [('tables', element, 0.9)]
+        return [('columns', element, 0.8)]
+    
     def _apply_domain_mappings(self, question: str, mappings: Dict[str, Any]):
         """Apply predefined domain-specific mappings"""
-        question_lower = question.lower()
+        hits = set()
+        for concept in set(self._domain_re.findall(question.lower())):
+            hits |= self._domain_tags[concept]
         
-        for category, concepts in self.domain_mappings.items():
-            for concept, schema_elements in concepts.items():
-                if concept in question_lower:
-                    for element in schema_elements:
-                        if element.startswith('station_name ='):
-                            mappings['filters'].append({
-                                'condition': element,
-                                'confidence': 0.95
-                            })
-                        elif element.startswith('rider_gender ='):
-                            mappings['filters'].append({
-                                'condition': element,
-                                'confidence': 0.95
-                            })
-                        elif element.startswith('precipitation_mm'):
-                            mappings['filters'].append({
-                                'condition': element,
-                                'confidence': 0.9
-                            })
-                            mappings['tables'].append({
-                                'name': 'daily_weather',
-                                'confidence': 0.9
-                            })
-                        elif element.startswith('EXTRACT(ISODOW'):
-                            mappings['filters'].append({
-                                'condition': element,
-                                'confidence': 0.9
-                            })
-                        elif element in ['trips', 'stations', 'bikes', 'daily_weather']:
-                            mappings['tables'].append({
-                                'name': element,
-                                'confidence': 0.9
-                            })
-                        else:
-                            mappings['columns'].append({
-                                'name': element,
-                                'confidence': 0.8
-                            })
+        # Apply matches in domain_mappings order
+        for index in sorted(hits):
+            for key, value, confidence in self._domain_entries[index]:
+                if key == 'tables':
+                    self._add_table(mappings, value, confidence)
+                else:
+                    self._add_mapping(mappings, key, value, confidence)
     
     def _map_locations(self, locations: List[str], schema_info: Dict[str, Any], mappings: Dict[str, Any]):
         """Map location entities to station-related elements"""
@@ -150,30 +217,19 @@ class SemanticMapper:
             return
         
         # Add stations table if locations are mentioned
-        mappings['tables'].append({
-            'name': 'stations',
-            'confidence': 0.8
-        })
+        self._add_table(mappings, 'stations', 0.8)
         
         for location in locations:
             # Check for exact station name matches
             station_mapping = self._find_station_match(location.lower())
             if station_mapping:
-                mappings['filters'].append({
-                    'condition': station_mapping,
-                    'confidence': 0.9
-                })
+                self._add_mapping(mappings, 'filters', station_mapping, 0.9)
     
     def _find_station_match(self, location: str) -> Optional[str]:
         """Find matching station name in the database"""
-        station_names = [
-            'congress avenue', 'barton springs', 'capitol square',
-            'east side', 'river walk'
-        ]
-        
-        for station in station_names:
-            if self._similarity_score(location, station) > 0.7:
-                return f"station_name = '{station.title()}'"
+        match = process.extractOne(location, self._station_names, scorer=fuzz.ratio, score_cutoff=70)
+        if match:
+            return f"station_name = '{match[0].title()}'"
         
         return None
     
@@ -183,162 +239,89 @@ class SemanticMapper:
             if demo.get('type') == 'gender':
                 value = demo.get('value', '').lower()
                 if value in ['women', 'female']:
-                    mappings['filters'].append({
-                        'condition': "rider_gender = 'female'",
-                        'confidence': 0.95
-                    })
+                    self._add_mapping(mappings, 'filters', "rider_gender = 'female'", 0.95)
                 elif value in ['men', 'male']:
-                    mappings['filters'].append({
-                        'condition': "rider_gender = 'male'",
-                        'confidence': 0.95
-                    })
+                    self._add_mapping(mappings, 'filters', "rider_gender = 'male'", 0.95)
                 
-                mappings['tables'].append({
-                    'name': 'trips',
-                    'confidence': 0.9
-                })
+                self._add_table(mappings, 'trips', 0.9)
     
     def _map_weather_conditions(self, conditions: List[str], mappings: Dict[str, Any]):
         """Map weather conditions to weather table filters"""
         if not conditions:
             return
         
-        mappings['tables'].append({
-            'name': 'daily_weather',
-            'confidence': 0.9
-        })
+        self._add_table(mappings, 'daily_weather', 0.9)
         
         for condition in conditions:
             if condition == 'rainy':
-                mappings['filters'].append({
-                    'condition': 'precipitation_mm > 0',
-                    'confidence': 0.95
-                })
+                self._add_mapping(mappings, 'filters', 'precipitation_mm > 0', 0.95)
             elif condition == 'sunny':
-                mappings['filters'].append({
-                    'condition': 'precipitation_mm = 0',
-                    'confidence': 0.9
-                })
+                self._add_mapping(mappings, 'filters', 'precipitation_mm = 0', 0.9)
     
     def _map_time_periods(self, periods: List[str], mappings: Dict[str, Any]):
         """Map time periods to date filters"""
         for period in periods:
-            if 'june 2025' in period.lower():
-                mappings['date_filters'].append({
-                    'condition': "DATE_PART('month', started_at) = 6 AND DATE_PART('year', started_at) = 2025",
-                    'confidence': 0.95
-                })
-            elif 'first week' in period.lower() and 'june' in period.lower():
-                mappings['date_filters'].append({
-                    'condition': "started_at BETWEEN '2025-06-01' AND '2025-06-07'",
-                    'confidence': 0.9
-                })
-            elif 'last month' in period.lower():
-                mappings['date_filters'].append({
-                    'condition': "DATE_PART('month', started_at) = 6 AND DATE_PART('year', started_at) = 2025",
-                    'confidence': 0.8
-                })
+            for pattern, condition, confidence in _TIME_PATTERNS:
+                if pattern.search(period):
+                    self._add_mapping(mappings, 'date_filters', condition, confidence)
+                    break
     
     def _map_measurements(self, measurements: List[str], mappings: Dict[str, Any]):
         """Map measurement types to appropriate columns"""
         for measurement in measurements:
             if measurement == 'distance':
-                mappings['columns'].append({
-                    'name': 'trip_distance_km',
-                    'confidence': 0.9
-                })
+                self._add_mapping(mappings, 'columns', 'trip_distance_km', 0.9)
             elif measurement == 'time':
-                mappings['columns'].append({
-                    'name': 'ended_at - started_at',
-                    'confidence': 0.8
-                })
+                self._add_mapping(mappings, 'columns', 'ended_at - started_at', 0.8)
     
     def _map_aggregations(self, aggregations: List[str], mappings: Dict[str, Any]):
         """Map aggregation functions"""
         for agg in aggregations:
-            mappings['aggregations'].append({
-                'function': agg.upper(),
-                'confidence': 0.95
-            })
+            self._add_mapping(mappings, 'aggregations', agg.upper(), 0.95)
     
     def _map_bike_types(self, question: str, mappings: Dict[str, Any]):
         """Map bike type mentions to specific bike models"""
-        question_lower = question.lower()
-        
-        bike_mappings = {
-            'ebikes': "bike_model = 'E‑Bike'",
-            'e-bikes': "bike_model = 'E‑Bike'",
-            'electric bikes': "bike_model = 'E‑Bike'",
-            'electric': "bike_model = 'E‑Bike'",
-            'classic bikes': "bike_model = 'Classic'",
-            'classic': "bike_model = 'Classic'",
-            'step-thru': "bike_model = 'Step‑Thru'",
-            'step thru': "bike_model = 'Step‑Thru'"
-        }
-        
-        for bike_term, condition in bike_mappings.items():
-            if bike_term in question_lower:
-                mappings['filters'].append({
-                    'condition': condition,
-                    'confidence': 0.95
-                })
-                mappings['tables'].append({
-                    'name': 'bikes',
-                    'confidence': 0.9
-                })
-                break
+        match = _BIKE_TYPE_RE.match(question)
+        if match:
+            self._add_mapping(mappings, 'filters', _BIKE_TYPE_CONDITIONS[match.lastgroup], 0.95)
+            self._add_table(mappings, 'bikes', 0.9)
+    
+    def _add_mapping(self, mappings: Dict[str, Any], key: str, value: str, confidence: float):
+        """Append a value and its confidence to one of the parallel-list categories"""
+        category = mappings[key]
+        category[_MAPPING_FIELDS[key]].append(value)
+        category['confidence'].append(confidence)
+    
+    def _add_table(self, mappings: Dict[str, Any], name: str, confidence: float):
+        """Record a table, keeping the highest confidence it has been mapped with"""
+        tables = mappings['tables']
+        tables[name] = max(tables.get(name, 0.0), confidence)
     
     def _determine_joins(self, mappings: Dict[str, Any], schema_info: Dict[str, Any]):
         """Determine necessary joins based on mapped tables"""
-        table_names = [t['name'] for t in mappings['tables']]
-        unique_tables = list(set(table_names))
+        present = mappings['tables'].keys()
         
-        # Define common join patterns
-        join_patterns = {
-            ('trips', 'stations'): [
-                "trips.start_station_id = stations.station_id",
-                "trips.end_station_id = stations.station_id"
-            ],
-            ('trips', 'daily_weather'): [
-                "DATE(trips.started_at) = daily_weather.weather_date"
-            ],
-            ('trips', 'bikes'): [
-                "trips.bike_id = bikes.bike_id"
-            ]
-        }
-        
-        for i, table1 in enumerate(unique_tables):
-            for table2 in unique_tables[i+1:]:
-                join_key = tuple(sorted([table1, table2]))
-                if join_key in join_patterns:
-                    for join_condition in join_patterns[join_key]:
-                        mappings['joins'].append({
-                            'condition': join_condition,
-                            'confidence': 0.9
-                        })
+        for (table1, table2), join_conditions in _JOIN_PATTERNS.items():
+            if table1 in present and table2 in present:
+                for join_condition in join_conditions:
+                    self._add_mapping(mappings, 'joins', join_condition, 0.9)
     
     def _similarity_score(self, str1: str, str2: str) -> float:
         """Calculate similarity score between two strings"""
-        return SequenceMatcher(None, str1.lower(), str2.lower()).ratio()
+        return fuzz.ratio(str1.lower(), str2.lower()) / 100
     
     def score_column_relevance(self, column_name: str, user_text: str) -> float:
         """
         Score how relevant a column is to the user's question
         Higher score means more relevant
         """
-        user_words = set(user_text.lower().split())
-        column_words = set(column_name.lower().replace('_', ' ').split())
+        user_text = user_text.lower()
+        column_text = column_name.lower().replace('_', ' ')
         
         # Direct word matches
-        direct_matches = len(user_words.intersection(column_words))
+        direct_matches = len(set(user_text.split()) & set(column_text.split()))
         if direct_matches > 0:
             return 0.8 + (direct_matches * 0.1)
         
-        # Semantic similarity
-        max_similarity = 0
-        for user_word in user_words:
-            for col_word in column_words:
-                similarity = self._similarity_score(user_word, col_word)
-                max_similarity = max(max_similarity, similarity)
-        
-        return max_similarity * 0.6
+        # Fuzzy similarity of the two word sets
+        return fuzz.token_set_ratio(user_text, column_text) / 100 * 0.6
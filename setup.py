@@ -7,15 +7,23 @@ setup(
     install_requires=[
         "flask>=3.1.1",
         "flask-sqlalchemy>=3.1.1",
+        "gevent>=24.2.1",
         "gunicorn>=23.0.0",
+        "httpx>=0.27.0",
         "openai>=1.100.0",
+        "orjson>=3.9.0",
+        "psycogreen>=1.0.2",
         "psycopg2-binary>=2.9.10",
+        "rapidfuzz>=3.9.0",
         "pytest>=8.4.1",
-        "requests>=2.32.5",
+        "pytest-xdist>=3.6.0",
         "spacy>=3.8.7",
         "werkzeug>=3.1.3",
         "email-validator>=2.2.0",
         "python-dotenv>=1.1.1",
     ],
+    extras_require={
+        "hyperscan": ["hyperscan>=0.7.0"],
+    },
     python_requires=">=3.11",
 )
@@ -1,12 +1,15 @@
 import pytest
 from database import DatabaseManager
 
+# These tests need a live PostgreSQL server
+pytestmark = [pytest.mark.integration, pytest.mark.database]
+
 class TestDatabaseIntegration:
     """Integration tests for database operations"""
 
-    def test_schema_validation(self, db_manager):
+    def test_schema_validation(self, schema_info):
         """Test that the database schema matches expected structure"""
-        schema = db_manager.get_schema_info()
+        schema = schema_info
         
         # Verify required tables exist
         assert 'trips' in schema
@@ -67,39 +70,42 @@ class TestDatabaseIntegration:
             assert 'trip_count' in result[0]
             assert 'avg_distance' in result[0]
 
-    def test_transaction_rollback(self, db_manager):
+    @pytest.mark.xdist_group("serial")
+    def test_transaction_rollback(self, db_manager, savepoint):
         """Test transaction management and rollback"""
-        # Start transaction
-        db_manager.cursor.execute("BEGIN")
-        
         try:
-            # Execute invalid query to trigger rollback
-            db_manager.execute_query("SELECT * FROM nonexistent_table")
+            # Execute invalid query to abort the transaction
+            savepoint.execute("SELECT * FROM nonexistent_table")
         except Exception:
-            # Ensure transaction is rolled back
-            db_manager.cursor.execute("ROLLBACK")
+            # Roll back to the savepoint so the transaction is usable again
+            savepoint.execute("ROLLBACK TO SAVEPOINT t")
+        
+        savepoint.execute("SELECT 1 as test")
+        assert savepoint.fetchone()[0] == 1
         
         # Verify we can still execute queries
         result = db_manager.execute_query("SELECT 1 as test")
         assert result is not None
         assert result[0]['test'] == 1
 
-    def test_concurrent_connections(self):
-        """Test handling multiple database connections"""
+    def test_concurrent_connections(self, register_cleanup):
+        """Test that managers share one pool and can hold connections at the same time"""
         db1 = DatabaseManager()
         db2 = DatabaseManager()
+        register_cleanup(db1.close)
         
-        # Execute queries on both connections
-        result1 = db1.execute_query("SELECT COUNT(*) as count FROM trips")
-        result2 = db2.execute_query("SELECT COUNT(*) as count FROM stations")
-        
-        assert result1 is not None
-        assert result2 is not None
+        assert db1._get_pool() is db2._get_pool()
         
-        # Clean up
-        db1.close()
-        db2.close()
+        # Check out two connections from the shared pool at once
+        with db1.get_connection() as conn1, db2.get_connection() as conn2:
+            assert conn1 is not conn2
+            with conn1.cursor() as cur1, conn2.cursor() as cur2:
+                cur1.execute("SELECT COUNT(*) as count FROM trips")
+                cur2.execute("SELECT COUNT(*) as count FROM stations")
+                assert cur1.fetchone() is not None
+                assert cur2.fetchone() is not None
 
+    @pytest.mark.xdist_group("serial")
     def test_error_conditions(self, db_manager):
         """Test various error conditions"""
         # Test invalid SQL
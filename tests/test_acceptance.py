@@ -1,111 +1,62 @@
 import pytest
-import requests
+import httpx
 import json
 import time
 from typing import Dict, Any
 
+def _number(answer: Any) -> float:
+    """Answer of a single-value aggregate"""
+    if not isinstance(answer, (int, float)):
+        pytest.fail(f"Unexpected result format: {answer}")
+    return answer
+
+def _station(answer: Any) -> str:
+    """Text of the top row of a station ranking"""
+    if isinstance(answer, str):
+        return answer
+    if isinstance(answer, list) and len(answer) > 0:
+        first_row = answer[0]
+        if isinstance(first_row, dict):
+            return " ".join(str(value) for value in first_row.values())
+        return str(first_row)
+    pytest.fail(f"Unexpected result format: {answer}")
+
+# Public test cases: question, expected answer and how to read it from the result
+CASES = [
+    pytest.param(
+        "What was the average ride time for journeys that started at Congress Avenue in June 2025?",
+        25, _number, id="T-1"
+    ),
+    pytest.param(
+        "Which docking point saw the most departures during the first week of June 2025?",
+        "Congress Avenue", _station, id="T-2"
+    ),
+    pytest.param(
+        "How many kilometres were ridden by women on rainy days in June 2025?",
+        6.8, _number, id="T-3"
+    ),
+]
+
 class TestAcceptance:
-    """Acceptance tests for the three public test cases"""
-    
-    BASE_URL = "http://localhost:5000"
+    """Acceptance tests for the three public test cases, run in-process"""
     
-    @classmethod
-    def setup_class(cls):
-        """Wait for server to be ready"""
-        max_retries = 10
-        for i in range(max_retries):
-            try:
-                response = requests.get(f"{cls.BASE_URL}/health")
-                if response.status_code == 200:
-                    break
-            except requests.ConnectionError:
-                if i < max_retries - 1:
-                    time.sleep(2)
-                else:
-                    raise Exception("Server not available for testing")
+    @pytest.fixture(autouse=True)
+    def _client(self, client, answer_for):
+        """Dispatch requests straight into the Flask app"""
+        self.client = client
+        self.answer_for = answer_for
     
     def query_api(self, question: str) -> Dict[str, Any]:
         """Helper method to query the API"""
-        response = requests.post(
-            f"{self.BASE_URL}/query",
-            headers={"Content-Type": "application/json"},
-            json={"question": question}
-        )
-        
-        assert response.status_code == 200, f"API call failed: {response.text}"
-        return response.json()
-    
-    def test_t1_average_ride_time_congress_avenue_june_2025(self):
-        """
-        Test T-1: "What was the average ride time for journeys that started at Congress Avenue in June 2025?"
-        Expected answer: 25 minutes
-        """
-        question = "What was the average ride time for journeys that started at Congress Avenue in June 2025?"
-        
-        result = self.query_api(question)
-        
-        # Check that query executed without errors
-        assert result.get('error') is None, f"Query failed with error: {result.get('error')}"
-        
-        # Check that SQL was generated
-        assert result.get('sql') is not None, "No SQL query was generated"
-        
-        # Check the result - should be 25 minutes
-        answer = result.get('result')
-        assert answer is not None, "No result returned"
-        
-        # Convert to float for comparison (handle different numeric types)
-        if isinstance(answer, (int, float)):
-            assert abs(answer - 25) < 0.1, f"Expected 25 minutes, got {answer}"
-        else:
-            # If it's a more complex result structure, extract the value
-            pytest.fail(f"Unexpected result format: {answer}")
-    
-    def test_t2_most_departures_first_week_june_2025(self):
-        """
-        Test T-2: "Which docking point saw the most departures during the first week of June 2025?"
-        Expected answer: Congress Avenue
-        """
-        question = "Which docking point saw the most departures during the first week of June 2025?"
-        
-        result = self.query_api(question)
-        
-        # Check that query executed without errors
-        assert result.get('error') is None, f"Query failed with error: {result.get('error')}"
-        
-        # Check that SQL was generated
-        assert result.get('sql') is not None, "No SQL query was generated"
-        
-        # Check the result - should be "Congress Avenue"
-        answer = result.get('result')
-        assert answer is not None, "No result returned"
+        response = self.answer_for(question)
         
-        # Handle different result formats
-        if isinstance(answer, str):
-            assert "Congress Avenue" in answer, f"Expected 'Congress Avenue', got '{answer}'"
-        elif isinstance(answer, list) and len(answer) > 0:
-            # If result is a list of rows, check the first row
-            first_row = answer[0]
-            if isinstance(first_row, dict):
-                # Find the station name in the row
-                station_found = False
-                for key, value in first_row.items():
-                    if "Congress Avenue" in str(value):
-                        station_found = True
-                        break
-                assert station_found, f"Expected 'Congress Avenue' in result: {first_row}"
-            else:
-                assert "Congress Avenue" in str(first_row), f"Expected 'Congress Avenue', got {first_row}"
-        else:
-            pytest.fail(f"Unexpected result format: {answer}")
+        assert response.status_code == 200, f"API call failed: {response.get_data(as_text=True)}"
+        return response.get_json()
     
-    def test_t3_kilometers_women_rainy_days_june_2025(self):
-        """
-        Test T-3: "How many kilometres were ridden by women on rainy days in June 2025?"
-        Expected answer: 6.8 km
-        """
-        question = "How many kilometres were ridden by women on rainy days in June 2025?"
-        
+    @pytest.mark.database
+    @pytest.mark.parametrize("question,expected,extractor", CASES)
+    def test_acceptance_case(self, question, expected, extractor):
+        """Test that a public test case returns its expected answer"""
         result = self.query_api(question)
         
         # Check that query executed without errors
@@ -114,51 +65,86 @@ class TestAcceptance:
         # Check that SQL was generated
         assert result.get('sql') is not None, "No SQL query was generated"
         
-        # Check the result - should be 6.8 km
         answer = result.get('result')
         assert answer is not None, "No result returned"
         
-        # Convert to float for comparison
-        if isinstance(answer, (int, float)):
-            assert abs(answer - 6.8) < 0.1, f"Expected 6.8 km, got {answer}"
+        value = extractor(answer)
+        if isinstance(expected, str):
+            assert expected in value, f"Expected '{expected}', got '{value}'"
         else:
-            # If it's a more complex result structure, extract the value
-            pytest.fail(f"Unexpected result format: {answer}")
+            assert abs(value - expected) < 0.1, f"Expected {expected}, got {value}"
     
     def test_api_error_handling(self):
         """Test that API handles errors gracefully"""
         # Test empty question
-        response = requests.post(
-            f"{self.BASE_URL}/query",
-            headers={"Content-Type": "application/json"},
-            json={"question": ""}
-        )
+        response = self.client.post('/query', json={"question": ""})
         
         assert response.status_code == 400
-        result = response.json()
+        result = response.get_json()
         assert result.get('error') is not None
     
     def test_api_malformed_request(self):
         """Test handling of malformed requests"""
         # Test non-JSON request
-        response = requests.post(
-            f"{self.BASE_URL}/query",
-            headers={"Content-Type": "text/plain"},
-            data="not json"
-        )
+        response = self.client.post('/query', content_type="text/plain", data="not json")
         
         assert response.status_code == 400
-        result = response.json()
+        result = response.get_json()
         assert result.get('error') is not None
     
+    @pytest.mark.database
     def test_health_endpoint(self):
         """Test health check endpoint"""
-        response = requests.get(f"{self.BASE_URL}/health")
+        response = self.client.get('/health')
         
         assert response.status_code == 200
-        result = response.json()
+        result = response.get_json()
         assert result.get('status') == 'healthy'
         assert result.get('database') == 'connected'
 
+LIVE_BASE_URL = "http://localhost:5000"
+
+@pytest.fixture(scope="module")
+def live_client(register_cleanup):
+    """Open a keep-alive client and wait for the server to be ready"""
+    client = httpx.Client(
+        base_url=LIVE_BASE_URL,
+        timeout=10.0,
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=4)
+    )
+    register_cleanup(client.close)
+    
+    max_retries = 10
+    delay = 0.05
+    for i in range(max_retries):
+        try:
+            response = client.get("/health")
+            if response.status_code == 200:
+                break
+        except httpx.TransportError:
+            if i < max_retries - 1:
+                # Back off exponentially, waiting at most a second between attempts
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+            else:
+                raise Exception("Server not available for testing")
+    return client
+
+@pytest.mark.live
+class TestLiveServer:
+    """Pre-deploy smoke test against a running server"""
+    
+    def test_live_query(self, live_client):
+        """Test that the deployed server answers a public test case end to end"""
+        response = live_client.post(
+            "/query",
+            json={"question": "What was the average ride time for journeys that started at Congress Avenue in June 2025?"}
+        )
+        
+        assert response.status_code == 200, f"API call failed: {response.text}"
+        result = response.json()
+        assert result.get('error') is None, f"Query failed with error: {result.get('error')}"
+        assert result.get('sql') is not None
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -1,49 +1,127 @@
+import asyncio
+import json
 import pytest
 import os
-from unittest.mock import Mock, patch, MagicMock
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, Mock, patch, MagicMock, create_autospec
 from query_generator import QueryGenerator
 from database import DatabaseManager
 from semantic_mapper import SemanticMapper
 
+def make_chunk(content):
+    """Build a streamed completion chunk carrying content"""
+    chunk = Mock()
+    chunk.choices = [Mock()]
+    chunk.choices[0].delta.content = content
+    return chunk
+
+class FakeAsyncStream:
+    """Async iterable standing in for a streamed completion"""
+    
+    def __init__(self, contents):
+        self.chunks = [make_chunk(content) for content in contents]
+        self.closed = False
+    
+    def __aiter__(self):
+        return self._iterate()
+    
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+    
+    async def close(self):
+        self.closed = True
+
+class _CompletionHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a fixed chat completion over a keep-alive connection"""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({
+            "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": '{"sql": "SELECT 1", "params": []}'}}]
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def completion_server():
+    """Base URL of a local OpenAI-compatible server"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _CompletionHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(scope="class")
+def mock_openai():
+    """Shared OpenAI client mock, in place before any QueryGenerator is built"""
+    with patch('query_generator._openai_client', MagicMock()) as mock:
+        yield mock
+
+@pytest.fixture(scope="module")
+def mock_db_manager():
+    """Database manager mock with a fixed schema"""
+    mock = create_autospec(DatabaseManager, instance=True)
+    
+    # Mock schema info
+    mock.get_schema_info.return_value = {
+        'trips': {
+            'columns': [
+                {'name': 'trip_id', 'type': 'integer', 'nullable': False, 'key_type': 'PRIMARY KEY'},
+                {'name': 'started_at', 'type': 'timestamp', 'nullable': True, 'key_type': 'REGULAR'},
+                {'name': 'rider_gender', 'type': 'varchar', 'nullable': True, 'key_type': 'REGULAR'},
+                {'name': 'trip_distance_km', 'type': 'numeric', 'nullable': True, 'key_type': 'REGULAR'}
+            ],
+            'primary_keys': ['trip_id'],
+            'foreign_keys': []
+        },
+        'stations': {
+            'columns': [
+                {'name': 'station_id', 'type': 'integer', 'nullable': False, 'key_type': 'PRIMARY KEY'},
+                {'name': 'station_name', 'type': 'varchar', 'nullable': False, 'key_type': 'REGULAR'}
+            ],
+            'primary_keys': ['station_id'],
+            'foreign_keys': []
+        }
+    }
+    return mock
+
+@pytest.fixture(scope="module")
+def mock_semantic_mapper():
+    """Semantic mapper mock; tests set the mappings they need"""
+    return create_autospec(SemanticMapper, instance=True)
+
 class TestQueryGenerator:
     """Unit tests for QueryGenerator class"""
     
-    def setup_method(self):
+    @pytest.fixture(autouse=True)
+    def _setup(self, mock_openai, mock_db_manager, mock_semantic_mapper):
         """Set up test fixtures"""
-        self.mock_db_manager = Mock(spec=DatabaseManager)
-        self.mock_semantic_mapper = Mock(spec=SemanticMapper)
-        
-        # Mock schema info
-        self.mock_db_manager.get_schema_info.return_value = {
-            'trips': {
-                'columns': [
-                    {'name': 'trip_id', 'type': 'integer', 'nullable': False, 'key_type': 'PRIMARY KEY'},
-                    {'name': 'started_at', 'type': 'timestamp', 'nullable': True, 'key_type': 'REGULAR'},
-                    {'name': 'rider_gender', 'type': 'varchar', 'nullable': True, 'key_type': 'REGULAR'},
-                    {'name': 'trip_distance_km', 'type': 'numeric', 'nullable': True, 'key_type': 'REGULAR'}
-                ],
-                'primary_keys': ['trip_id'],
-                'foreign_keys': []
-            },
-            'stations': {
-                'columns': [
-                    {'name': 'station_id', 'type': 'integer', 'nullable': False, 'key_type': 'PRIMARY KEY'},
-                    {'name': 'station_name', 'type': 'varchar', 'nullable': False, 'key_type': 'REGULAR'}
-                ],
-                'primary_keys': ['station_id'],
-                'foreign_keys': []
-            }
-        }
+        mock_openai.reset_mock(return_value=True, side_effect=True)
+        mock_openai.chat.completions.create.return_value = [make_chunk('{}')]
+        mock_db_manager.reset_mock()
+        mock_semantic_mapper.reset_mock(return_value=True, side_effect=True)
         
+        self.mock_db_manager = mock_db_manager
+        self.mock_semantic_mapper = mock_semantic_mapper
         self.query_generator = QueryGenerator(self.mock_db_manager, self.mock_semantic_mapper)
     
-    @patch('query_generator.OpenAI')
     def test_generate_query_success(self, mock_openai):
         """Test successful query generation"""
-        # Mock OpenAI response
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = '''
+        # Mock OpenAI response, streamed in two chunks
+        content = '''
         {
             "sql": "SELECT AVG(EXTRACT(EPOCH FROM (ended_at - started_at))/60) FROM trips t JOIN stations s ON t.start_station_id = s.station_id WHERE s.station_name = %s AND DATE_PART('month', started_at) = %s AND DATE_PART('year', started_at) = %s",
             "params": ["Congress Avenue", 6, 2025],
@@ -51,13 +129,15 @@ class TestQueryGenerator:
         }
         '''
         
-        mock_openai.return_value.chat.completions.create.return_value = mock_response
+        mock_openai.chat.completions.create.return_value = [
+            make_chunk(content[:100]), make_chunk(content[100:])
+        ]
         
         # Mock semantic mapping
         self.mock_semantic_mapper.map_entities_to_schema.return_value = {
-            'tables': [{'name': 'trips', 'confidence': 0.9}],
-            'filters': [{'condition': "station_name = 'Congress Avenue'", 'confidence': 0.95}],
-            'date_filters': [{'condition': "DATE_PART('month', started_at) = 6", 'confidence': 0.9}]
+            'tables': {'trips': 0.9},
+            'filters': {'condition': ["station_name = 'Congress Avenue'"], 'confidence': [0.95]},
+            'date_filters': {'condition': ["DATE_PART('month', started_at) = 6"], 'confidence': [0.9]}
         }
         
         question = "What was the average ride time for journeys that started at Congress Avenue in June 2025?"
@@ -73,18 +153,251 @@ class TestQueryGenerator:
         assert 'SELECT AVG' in result['sql']
         assert result['params'] == ["Congress Avenue", 6, 2025]
     
-    @patch('query_generator.OpenAI')
     def test_generate_query_llm_error(self, mock_openai):
         """Test handling of LLM errors"""
-        mock_openai.return_value.chat.completions.create.side_effect = Exception("API Error")
+        mock_openai.chat.completions.create.side_effect = Exception("API Error")
         
         self.mock_semantic_mapper.map_entities_to_schema.return_value = {}
         
         result = self.query_generator.generate_query("test question", {})
         
         assert result['error'] is not None
-        assert "LLM generation error" in result['error']
-        assert result['sql'] is None
+        assert result == self.query_generator._llm_failure()
+        assert "couldn't understand your question" in result['error']
+    
+    def test_generate_query_batch_timeout(self):
+        """Test that a batch that never completes yields the LLM failure result, uncached"""
+        self.query_generator._batcher = Mock(timeout=0.1)
+        self.query_generator._batcher.submit.side_effect = TimeoutError()
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {}
+        
+        result = self.query_generator.generate_query("What is the average trip distance?", {})
+        
+        assert result == self.query_generator._llm_failure()
+        assert not self.query_generator._sql_cache
+    
+    def test_generate_query_template(self):
+        """Test that plain trip counts are built without calling the LLM"""
+        self.query_generator._batcher = Mock()
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {
+            'tables': {'trips': 0.9},
+            'columns': {'name': [], 'confidence': []},
+            'aggregations': {'function': ['COUNT'], 'confidence': [0.9]},
+            'filters': {
+                'condition': ["rider_gender = 'female'", "EXTRACT(ISODOW FROM started_at) IN (6, 7)"],
+                'confidence': [0.9, 0.9]
+            },
+            'date_filters': {'condition': [], 'confidence': []}
+        }
+        
+        result = self.query_generator.generate_query("How many trips did women take on weekends?", {})
+        
+        assert result == {
+            "sql": "SELECT COUNT(*) AS trip_count FROM trips "
+                   "WHERE EXTRACT(ISODOW FROM started_at) IN (6, 7) AND rider_gender = %s",
+            "params": ['female'],
+            "error": None
+        }
+        self.query_generator._batcher.submit.assert_not_called()
+    
+    @pytest.mark.parametrize("question,entities,filters", [
+        ("How many trips happened in July 2025?", {'dates': ['July 2025']}, []),
+        ("How many trips were there in 2024?", {'dates': ['2024']}, []),
+        ("How many trips did male riders take in the evening?",
+         {'time_periods': ['evening'], 'demographics': [{'type': 'gender', 'value': 'male'}]},
+         ["rider_gender = 'male'"]),
+        ("How many trips happened on weekends in the morning?",
+         {'time_periods': ['morning', 'weekend']},
+         ["EXTRACT(ISODOW FROM started_at) IN (6, 7)"]),
+        ("How many trips started after 5pm?", {'dates': ['5pm']}, []),
+        ("How many trips started after five?", {}, []),
+        ("How many trips were not on weekends?", {'time_periods': ['weekend']},
+         ["EXTRACT(ISODOW FROM started_at) IN (6, 7)"]),
+        ("How many trips excluding weekends?", {'time_periods': ['weekend']},
+         ["EXTRACT(ISODOW FROM started_at) IN (6, 7)"]),
+        ("How many trips weren't on weekends?", {'time_periods': ['weekend']},
+         ["EXTRACT(ISODOW FROM started_at) IN (6, 7)"]),
+        ("How many round trips were there?", {}, []),
+        ("How many trips started in Austin?", {}, []),
+        ("How many trips were taken in the last quarter?", {}, []),
+        ("How many trips by weekday?", {'time_periods': ['weekday']},
+         ["EXTRACT(ISODOW FROM started_at) BETWEEN 1 AND 5"]),
+        ("How many trips did women take?", {'demographics': [{'type': 'gender', 'value': 'women'}]}, [])
+    ])
+    def test_generate_query_template_falls_back(self, question, entities, filters):
+        """Test that counts with entities the template cannot filter on go to the LLM"""
+        self.query_generator._batcher = Mock()
+        self.query_generator._batcher.submit.return_value = {
+            "sql": "SELECT COUNT(*) FROM trips", "params": [], "error": None
+        }
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {
+            'tables': {'trips': 0.9},
+            'columns': {'name': [], 'confidence': []},
+            'aggregations': {'function': ['COUNT'], 'confidence': [0.9]},
+            'filters': {'condition': filters, 'confidence': [0.9] * len(filters)},
+            'date_filters': {'condition': [], 'confidence': []}
+        }
+        
+        self.query_generator.generate_query(question, entities)
+        
+        self.query_generator._batcher.submit.assert_called_once()
+    
+    def test_generate_query_cached(self):
+        """Test that a repeated question reuses the generated SQL"""
+        self.query_generator._batcher = Mock()
+        self.query_generator._batcher.submit.return_value = {
+            "sql": "SELECT AVG(trip_distance_km) FROM trips", "params": [], "error": None
+        }
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {}
+        
+        first = self.query_generator.generate_query("What is the average trip distance?", {})
+        second = self.query_generator.generate_query("  what is the AVERAGE trip distance? ", {})
+        
+        assert first == second
+        assert self.query_generator._batcher.submit.call_count == 1
+    
+    def test_generate_query_shares_schema(self):
+        """Test that each question reads the database manager's schema and shares it with the semantic mapper"""
+        self.query_generator._batcher = Mock()
+        self.query_generator._batcher.submit.return_value = {"sql": None, "params": [], "error": "LLM failed"}
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {}
+        schema_info = self.mock_db_manager.get_schema_info.return_value
+        refreshed = {**schema_info}
+        
+        self.query_generator.generate_query("What is the average trip distance?", {})
+        self.mock_semantic_mapper.map_entities_to_schema.assert_called_with(
+            "What is the average trip distance?", {}, schema_info
+        )
+        
+        # A schema refreshed by the database manager is picked up by the next question
+        with patch.object(self.mock_db_manager, 'get_schema_info', return_value=refreshed):
+            self.query_generator.generate_query("Which station is busiest?", {})
+        self.mock_semantic_mapper.map_entities_to_schema.assert_called_with(
+            "Which station is busiest?", {}, refreshed
+        )
+        
+        self.query_generator.invalidate_schema()
+        self.mock_db_manager.invalidate_schema.assert_called_once()
+    
+    def test_generate_query_batch(self):
+        """Test concurrent async generation keeps results in input order"""
+        def make_response(**kwargs):
+            table = 'stations' if 'stations' in kwargs['messages'][1]['content'] else 'trips'
+            response = Mock()
+            response.choices = [Mock()]
+            response.choices[0].message.content = f'{{"sql": "SELECT COUNT(*) FROM {table}", "params": []}}'
+            return response
+        
+        self.query_generator.async_openai_client = Mock()
+        self.query_generator.async_openai_client.chat.completions.create = AsyncMock(side_effect=make_response)
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {}
+        
+        results = asyncio.run(self.query_generator.generate_query_batch(
+            [("How many trips?", {}), ("How many stations?", {})], max_concurrency=1
+        ))
+        
+        assert [result['sql'] for result in results] == [
+            "SELECT COUNT(*) FROM trips",
+            "SELECT COUNT(*) FROM stations"
+        ]
+        assert all(result['error'] is None for result in results)
+    
+    def test_generate_queries_multi(self):
+        """Test that several questions share one LLM call and keep their order"""
+        response = Mock()
+        response.choices = [Mock()]
+        response.choices[0].message.content = """
+        {
+            "results": [
+                {"id": 1, "sql": "SELECT COUNT(*) FROM stations", "params": []},
+                {"id": 0, "sql": "SELECT AVG(trip_distance_km) FROM trips", "params": []}
+            ]
+        }
+        """
+        self.query_generator.async_openai_client = Mock()
+        self.query_generator.async_openai_client.chat.completions.create = AsyncMock(return_value=response)
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {}
+        
+        results = asyncio.run(self.query_generator.generate_queries_multi(
+            [("What is the average trip distance?", {}), ("How many stations are there?", {})]
+        ))
+        
+        assert [result['sql'] for result in results] == [
+            "SELECT AVG(trip_distance_km) FROM trips",
+            "SELECT COUNT(*) FROM stations"
+        ]
+        self.query_generator.async_openai_client.chat.completions.create.assert_awaited_once()
+    
+    def test_generate_query_stream(self):
+        """Test that partial SQL is yielded while the completion streams in"""
+        stream = FakeAsyncStream([
+            '{"sql": "SELECT COUNT(*) ',
+            'FROM trips WHERE rider_gender = %s", ',
+            '"params": ["female"]}'
+        ])
+        self.query_generator.async_openai_client = Mock()
+        self.query_generator.async_openai_client.chat.completions.create = AsyncMock(return_value=stream)
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {}
+        
+        async def collect():
+            return [event async for event in self.query_generator.generate_query_stream("How many trips by women?", {})]
+        
+        events = asyncio.run(collect())
+        
+        assert events[0] == {"partial_sql": "SELECT COUNT(*) "}
+        assert events[1] == {"partial_sql": "SELECT COUNT(*) FROM trips WHERE rider_gender = %s"}
+        assert events[-1] == {"result": {
+            "sql": "SELECT COUNT(*) FROM trips WHERE rider_gender = %s",
+            "params": ["female"],
+            "error": None
+        }}
+        assert stream.closed
+    
+    def test_generate_query_stream_rejects_unsafe_sql(self):
+        """Test that unsafe SQL ends the stream before the completion finishes"""
+        stream = FakeAsyncStream(['{"sql": "DROP TA', 'BLE trips", ', '"params": []}'])
+        self.query_generator.async_openai_client = Mock()
+        self.query_generator.async_openai_client.chat.completions.create = AsyncMock(return_value=stream)
+        self.mock_semantic_mapper.map_entities_to_schema.return_value = {}
+        
+        async def collect():
+            return [event async for event in self.query_generator.generate_query_stream("Remove all trips", {})]
+        
+        events = asyncio.run(collect())
+        
+        assert len(events) == 1
+        assert events[0]["result"]["sql"] is None
+        assert stream.closed
+    
+    def test_async_client_survives_new_event_loops(self, completion_server, monkeypatch):
+        """Test that async calls from separate asyncio.run() loops each get a working client"""
+        monkeypatch.setenv('OPENAI_BASE_URL', completion_server)
+        
+        for _ in range(2):
+            content = asyncio.run(self.query_generator._request_completion_async("system", "user"))
+            assert json.loads(content)["sql"] == "SELECT 1"
+    
+    def test_openai_clients_shared(self):
+        """Test that QueryGenerators share one sync client and one async client per event loop"""
+        other = QueryGenerator(self.mock_db_manager, self.mock_semantic_mapper)
+        
+        async def clients():
+            return self.query_generator._async_client(), other._async_client()
+        
+        first = asyncio.run(clients())
+        second = asyncio.run(clients())
+        
+        assert other.openai_client is self.query_generator.openai_client
+        assert first[0] is first[1]
+        assert second[0] is not first[0]
+    
+    def test_normalize_bike_model_params(self):
+        """Test that bike model spellings map to the Unicode names stored in the database"""
+        params = ['e-bike', 'E\u2010BIKE', 'Step\u2013thru', '\uff25-Bike', 'classic', 'Congress Avenue', 6]
+        
+        assert self.query_generator._normalize_bike_model_params(params) == [
+            'E\u2011Bike', 'E\u2011Bike', 'Step\u2011Thru', 'E\u2011Bike', 'Classic', 'Congress Avenue', 6
+        ]
     
     def test_validate_sql_safety_secure(self):
         """Test SQL safety validation for secure queries"""
@@ -1,37 +1,43 @@
 import pytest
-from unittest.mock import Mock
+from unittest.mock import create_autospec
 from semantic_mapper import SemanticMapper
 from database import DatabaseManager
 
+@pytest.fixture(scope="module")
+def mock_db_manager():
+    """Database manager mock with a fixed schema, shared by the module's tests"""
+    mock = create_autospec(DatabaseManager, instance=True)
+    mock.get_schema_info.return_value = {
+        'trips': {
+            'columns': [
+                {'name': 'trip_id', 'type': 'integer'},
+                {'name': 'rider_gender', 'type': 'varchar'},
+                {'name': 'started_at', 'type': 'timestamp'},
+                {'name': 'trip_distance_km', 'type': 'numeric'}
+            ]
+        },
+        'stations': {
+            'columns': [
+                {'name': 'station_id', 'type': 'integer'},
+                {'name': 'station_name', 'type': 'varchar'}
+            ]
+        },
+        'daily_weather': {
+            'columns': [
+                {'name': 'weather_date', 'type': 'date'},
+                {'name': 'precipitation_mm', 'type': 'numeric'}
+            ]
+        }
+    }
+    return mock
+
 class TestSemanticMapper:
     """Unit tests for SemanticMapper class"""
     
-    def setup_method(self):
+    @pytest.fixture(autouse=True)
+    def _setup(self, mock_db_manager):
         """Set up test fixtures"""
-        self.mock_db_manager = Mock(spec=DatabaseManager)
-        self.mock_db_manager.get_schema_info.return_value = {
-            'trips': {
-                'columns': [
-                    {'name': 'trip_id', 'type': 'integer'},
-                    {'name': 'rider_gender', 'type': 'varchar'},
-                    {'name': 'started_at', 'type': 'timestamp'},
-                    {'name': 'trip_distance_km', 'type': 'numeric'}
-                ]
-            },
-            'stations': {
-                'columns': [
-                    {'name': 'station_id', 'type': 'integer'},
-                    {'name': 'station_name', 'type': 'varchar'}
-                ]
-            },
-            'daily_weather': {
-                'columns': [
-                    {'name': 'weather_date', 'type': 'date'},
-                    {'name': 'precipitation_mm', 'type': 'numeric'}
-                ]
-            }
-        }
-        
+        self.mock_db_manager = mock_db_manager
         self.semantic_mapper = SemanticMapper(self.mock_db_manager)
     
     def test_map_entities_basic(self):
@@ -45,12 +51,12 @@ class TestSemanticMapper:
         mappings = self.semantic_mapper.map_entities_to_schema(question, entities)
         
         # Check that gender filter is properly mapped
-        gender_filters = [f for f in mappings['filters'] if 'female' in f['condition']]
+        gender_filters = [f for f in mappings['filters']['condition'] if 'female' in f]
         assert len(gender_filters) > 0
-        assert gender_filters[0]['condition'] == "rider_gender = 'female'"
+        assert gender_filters[0] == "rider_gender = 'female'"
         
         # Check that trips table is included
-        table_names = [t['name'] for t in mappings['tables']]
+        table_names = list(mappings['tables'])
         assert 'trips' in table_names
     
     def test_map_weather_conditions(self):
@@ -64,12 +70,12 @@ class TestSemanticMapper:
         mappings = self.semantic_mapper.map_entities_to_schema(question, entities)
         
         # Check weather filter
-        weather_filters = [f for f in mappings['filters'] if 'precipitation_mm' in f['condition']]
+        weather_filters = [f for f in mappings['filters']['condition'] if 'precipitation_mm' in f]
         assert len(weather_filters) > 0
-        assert 'precipitation_mm > 0' in weather_filters[0]['condition']
+        assert 'precipitation_mm > 0' in weather_filters[0]
         
         # Check that daily_weather table is included
-        table_names = [t['name'] for t in mappings['tables']]
+        table_names = list(mappings['tables'])
         assert 'daily_weather' in table_names
     
     def test_map_location_entities(self):
@@ -82,11 +88,11 @@ class TestSemanticMapper:
         mappings = self.semantic_mapper.map_entities_to_schema(question, entities)
         
         # Check location filter
-        location_filters = [f for f in mappings['filters'] if 'Congress Avenue' in f['condition']]
+        location_filters = [f for f in mappings['filters']['condition'] if 'Congress Avenue' in f]
         assert len(location_filters) > 0
         
         # Check stations table is included
-        table_names = [t['name'] for t in mappings['tables']]
+        table_names = list(mappings['tables'])
         assert 'stations' in table_names
     
     def test_similarity_score(self):
@@ -115,22 +121,33 @@ class TestSemanticMapper:
     def test_determine_joins(self):
         """Test join determination logic"""
         mappings = {
-            'tables': [
-                {'name': 'trips', 'confidence': 0.9},
-                {'name': 'stations', 'confidence': 0.8}
-            ],
-            'joins': []
+            'tables': {'trips': 0.9, 'stations': 0.8},
+            'joins': {'condition': [], 'confidence': []}
         }
         
         self.semantic_mapper._determine_joins(mappings, self.mock_db_manager.get_schema_info.return_value)
         
         # Should have added join conditions
-        assert len(mappings['joins']) > 0
+        assert len(mappings['joins']['condition']) > 0
+        assert len(mappings['joins']['confidence']) == len(mappings['joins']['condition'])
         
         # Check for typical trip-station joins
-        join_conditions = [j['condition'] for j in mappings['joins']]
+        join_conditions = mappings['joins']['condition']
         assert any('start_station_id' in condition for condition in join_conditions)
     
+    def test_tables_keep_max_confidence(self):
+        """Test that a table mapped several times is listed once with its best confidence"""
+        question = "Trips by women on rainy days from Congress Avenue station"
+        entities = {
+            'locations': ['congress avenue'],
+            'demographics': [{'type': 'gender', 'value': 'women'}],
+            'weather_conditions': ['rainy']
+        }
+        
+        mappings = self.semantic_mapper.map_entities_to_schema(question, entities)
+        
+        assert mappings['tables'] == {'stations': 0.9, 'daily_weather': 0.9, 'trips': 0.9}
+    
     def test_find_station_match(self):
         """Test station name matching"""
         # Exact match
@@ -1,5 +1,37 @@
 import pytest
-from flask import json
+import orjson
+from unittest.mock import patch
+from app import semantic_cache
+from database import DatabaseManager
+from query_generator import QueryGenerator
+
+# Request bodies are fixed, so serialize them once
+VALID_BODY = orjson.dumps({
+    'question': 'What was the average ride time for journeys that started at Congress Avenue in June 2025?'
+})
+EMPTY_BODY = b'{"question": ""}'
+MISSING_BODY = b'{}'
+TOO_LONG_BODY = orjson.dumps({'question': 'How many trips? ' * 100})
+OFF_TOPIC_BODY = b'{"question": "Tell me a joke"}'
+SHORT_BODY = b'{"question": "What was the average ride time?"}'
+
+# Canned SQL and rows so the happy path exercises the route without the LLM or a database
+CANNED_SQL = {"sql": "SELECT 1 AS x", "params": [], "error": None}
+CANNED_ROWS = [{'x': 1}]
+
+@pytest.fixture(scope="module", autouse=True)
+def canned_query_path():
+    """Stub SQL generation, the database and question embedding for every test in this module"""
+    with pytest.MonkeyPatch.context() as mp:
+        # The app's embedder would call the OpenAI embeddings API
+        mp.setattr(semantic_cache, 'embedder', lambda text: [1.0, 0.0])
+        mp.setattr(QueryGenerator, 'generate_query', lambda self, question, entities: dict(CANNED_SQL))
+        mp.setattr(DatabaseManager, 'execute_query',
+                   lambda self, query, params=None, stream=False: (row for row in CANNED_ROWS))
+        mp.setattr(DatabaseManager, 'test_connection', lambda self: True)
+        yield
+    # Canned SQL must not be served to later modules from the app's cache
+    semantic_cache.clear()
 
 def test_index_route(client):
     """Test the main page route"""
@@ -7,72 +39,89 @@ def test_index_route(client):
     assert response.status_code == 200
     assert b'Bike Share Analytics' in response.data
 
-def test_query_endpoint_valid_request(client):
-    """Test query endpoint with valid request"""
-    data = {
-        'question': 'What was the average ride time for journeys that started at Congress Avenue in June 2025?'
-    }
-    response = client.post('/query',
-                          data=json.dumps(data),
-                          content_type='application/json')
-    assert response.status_code == 200
-    result = json.loads(response.data)
-    assert 'sql' in result
-    assert 'result' in result
-    assert result.get('error') is None
+@pytest.mark.parametrize("body,expected_status,expect_error", [
+    pytest.param(VALID_BODY, 200, False, id="valid_request"),
+    pytest.param(EMPTY_BODY, 400, True, id="empty_question"),
+    pytest.param(MISSING_BODY, 400, True, id="missing_question"),
+    pytest.param(TOO_LONG_BODY, 400, True, id="question_too_long"),
+    pytest.param(b'invalid json', 400, True, id="invalid_json"),
+])
+def test_query_endpoint(post_json, body, expected_status, expect_error):
+    """Test query endpoint status and error reporting for each kind of request body"""
+    response = post_json('/query', body)
+    assert response.status_code == expected_status
+    result = response.get_json()
+    if expect_error:
+        assert result.get('error') is not None
+    else:
+        assert 'sql' in result
+        assert 'result' in result
+        assert result.get('error') is None
 
-def test_query_endpoint_empty_question(client):
-    """Test query endpoint with empty question"""
-    data = {'question': ''}
+def test_query_endpoint_off_topic_question(client, monkeypatch):
+    """Test off-topic questions are answered without generating SQL"""
+    def mock_generate_query(*args):
+        raise AssertionError("LLM should not be called")
+    
+    monkeypatch.setattr(QueryGenerator, 'generate_query', mock_generate_query)
+    
     response = client.post('/query',
-                          data=json.dumps(data),
+                          data=OFF_TOPIC_BODY,
                           content_type='application/json')
-    assert response.status_code == 400
-    result = json.loads(response.data)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result.get('sql') is None
     assert result.get('error') is not None
 
-def test_query_endpoint_missing_question(client):
-    """Test query endpoint with missing question field"""
-    data = {}
-    response = client.post('/query',
-                          data=json.dumps(data),
-                          content_type='application/json')
-    assert response.status_code == 400
-    result = json.loads(response.data)
-    assert result.get('error') is not None
+class _Rows:
+    """Row iterator that records whether it was closed, like a streamed query"""
+    
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self.closed = False
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        return next(self._rows)
+    
+    def close(self):
+        self.closed = True
 
-def test_query_endpoint_invalid_json(client):
-    """Test query endpoint with invalid JSON"""
-    response = client.post('/query',
-                          data='invalid json',
-                          content_type='application/json')
-    assert response.status_code == 400
-    result = json.loads(response.data)
-    assert result.get('error') is not None
+@pytest.mark.parametrize("rows", [
+    pytest.param([], id="empty"),
+    pytest.param([{'x': 1}], id="scalar"),
+    pytest.param([{'x': None}], id="null_scalar"),
+    pytest.param([{'x': 1}, {'x': 2}], id="streamed"),
+])
+def test_query_endpoint_closes_rows(post_json, monkeypatch, rows):
+    """Test that the streamed rows are closed whether or not the response streams them"""
+    result_rows = _Rows(rows)
+    monkeypatch.setattr(DatabaseManager, 'execute_query',
+                        lambda self, query, params=None, stream=False: result_rows)
+    
+    response = post_json('/query', VALID_BODY)
+    
+    assert response.status_code == 200
+    assert response.get_json()['sql'] == CANNED_SQL['sql']
+    assert result_rows.closed
 
 def test_health_check_endpoint(client):
     """Test health check endpoint"""
     response = client.get('/health')
     assert response.status_code == 200
-    result = json.loads(response.data)
+    result = response.get_json()
     assert result['status'] == 'healthy'
     assert result['database'] == 'connected'
 
-def test_query_endpoint_error_handling(client, monkeypatch):
+@patch.object(QueryGenerator, 'generate_query', side_effect=Exception("Test error"))
+def test_query_endpoint_error_handling(mock_generate_query, client):
     """Test query endpoint error handling"""
-    # Mock the query generator to raise an exception
-    def mock_generate_query(*args):
-        raise Exception("Test error")
-    
-    from query_generator import QueryGenerator
-    monkeypatch.setattr(QueryGenerator, 'generate_query', mock_generate_query)
-    
-    data = {
-        'question': 'What was the average ride time?'
-    }
     response = client.post('/query',
-                          data=json.dumps(data),
+                          data=SHORT_BODY,
                           content_type='application/json')
     assert response.status_code == 500
-    result = json.loads(response.data)
+    result = response.get_json()
     assert result.get('error') is not None
+    mock_generate_query.assert_called_once()
@@ -0,0 +1,59 @@
+import threading
+import pytest
+from unittest.mock import Mock
+from batcher import RequestBatcher
+
+class TestRequestBatcher:
+    """Unit tests for RequestBatcher class"""
+
+    def test_concurrent_submits_share_a_flush(self):
+        """Test that calls arriving together are flushed as one batch"""
+        flush = Mock(side_effect=lambda items: [item * 2 for item in items])
+        batcher = RequestBatcher(flush, max_batch_size=4, max_wait=0.5)
+        results = {}
+
+        def submit(i):
+            results[i] = batcher.submit(i)
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == {0: 0, 1: 2, 2: 4, 3: 6}
+        flush.assert_called_once()
+
+    def test_batch_size_one_calls_flush_directly(self):
+        """Test that batching can be disabled"""
+        flush = Mock(return_value=['result'])
+        batcher = RequestBatcher(flush, max_batch_size=1)
+
+        assert batcher.submit('item') == 'result'
+        flush.assert_called_once_with(['item'])
+
+    def test_flush_error_reaches_caller(self):
+        """Test that a failed flush raises in every waiting caller"""
+        batcher = RequestBatcher(Mock(side_effect=Exception("API Error")), max_wait=0.01)
+
+        with pytest.raises(Exception, match="API Error"):
+            batcher.submit('item')
+
+    def test_result_count_mismatch(self):
+        """Test that a flush returning the wrong number of results is an error"""
+        batcher = RequestBatcher(Mock(return_value=[]), max_wait=0.01)
+
+        with pytest.raises(ValueError):
+            batcher.submit('item')
+
+    def test_submit_times_out(self):
+        """Test that a caller stops waiting when its batch is never flushed"""
+        release = threading.Event()
+        batcher = RequestBatcher(Mock(side_effect=lambda items: release.wait() and items),
+                                 max_wait=0.01, timeout=0.05)
+
+        try:
+            with pytest.raises(TimeoutError):
+                batcher.submit('item')
+        finally:
+            release.set()
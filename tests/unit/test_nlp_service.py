@@ -1,91 +1,90 @@
+import importlib.util
 import pytest
-from nlp_service import NLPService
 
-class TestNLPService:
-    """Unit tests for NLPService class"""
-
-    @pytest.fixture
-    def nlp_service(self):
-        """Create an NLPService instance"""
-        return NLPService()
-
-    def test_extract_entities_basic(self, nlp_service):
-        """Test basic entity extraction"""
-        question = "How many bikes were used on June 1st, 2025?"
-        entities = nlp_service.extract_entities(question)
-        
-        assert 'dates' in entities
-        assert any('2025' in date for date in entities['dates'])
-        assert 'aggregations' in entities
-        assert 'count' in entities['aggregations']
+# Dates and other named entities need the trained spaCy model; a blank model finds none
+requires_spacy_model = pytest.mark.skipif(
+    importlib.util.find_spec("en_core_web_sm") is None,
+    reason="en_core_web_sm is not installed"
+)
 
-    def test_extract_entities_location(self, nlp_service):
-        """Test location entity extraction"""
-        question = "Show me trips from Congress Avenue station"
-        entities = nlp_service.extract_entities(question)
-        
-        assert 'locations' in entities
-        assert 'congress avenue' in [loc.lower() for loc in entities['locations']]
-
-    def test_extract_entities_weather(self, nlp_service):
-        """Test weather condition extraction"""
-        question = "How many trips happened on rainy days?"
-        entities = nlp_service.extract_entities(question)
-        
-        assert 'weather_conditions' in entities
-        assert 'rainy' in entities['weather_conditions']
+def _contains(values, needle):
+    """
+    Whether needle appears in any of the values, ignoring case
+    Dict values such as demographics are compared on their 'value' text
+    """
+    return needle in ' '.join(
+        value['value'] if isinstance(value, dict) else value for value in values
+    ).lower()
 
-    def test_extract_entities_demographics(self, nlp_service):
-        """Test demographic entity extraction"""
-        question = "What's the average trip distance for women riders?"
-        entities = nlp_service.extract_entities(question)
-        
-        assert 'demographics' in entities
-        assert any('women' in demo.lower() for demo in entities['demographics'])
-        assert 'aggregations' in entities
-        assert 'average' in entities['aggregations']
+def _assert_entities_empty(entities):
+    """Every entity list is present and empty"""
+    assert all(isinstance(value, list) and not value for value in entities.values()), entities
 
-    def test_extract_entities_time_periods(self, nlp_service):
-        """Test time period extraction"""
-        question = "Show me morning rides during weekends"
-        entities = nlp_service.extract_entities(question)
-        
-        assert 'time_periods' in entities
-        assert any('morning' in period.lower() for period in entities['time_periods'])
-        assert any('weekend' in period.lower() for period in entities['time_periods'])
+# Question and a check on the entities extracted from it
+CASES = [
+    pytest.param(
+        "How many bikes were used on June 1st, 2025?",
+        lambda e: _contains(e['dates'], '2025') and 'count' in e['aggregations'],
+        id="basic",
+        marks=requires_spacy_model
+    ),
+    pytest.param(
+        "Show me trips from Congress Avenue station",
+        lambda e: 'congress avenue' in [loc.lower() for loc in e['locations']],
+        id="location"
+    ),
+    pytest.param(
+        "How many trips happened on rainy days?",
+        lambda e: 'rainy' in e['weather_conditions'],
+        id="weather"
+    ),
+    pytest.param(
+        "What's the average trip distance for women riders?",
+        lambda e: _contains(e['demographics'], 'women') and 'average' in e['aggregations'],
+        id="demographics"
+    ),
+    pytest.param(
+        "Show me morning rides during weekends",
+        lambda e: _contains(e['time_periods'], 'morning') and _contains(e['time_periods'], 'weekend'),
+        id="time_periods"
+    ),
+    pytest.param(
+        "What's the total distance traveled in kilometers?",
+        lambda e: _contains(e['measurements'], 'distance') and 'sum' in e['aggregations'],
+        id="measurements"
+    ),
+    pytest.param(
+        "What was the average ride time for women starting from Congress Avenue on rainy weekends in June 2025?",
+        lambda e: all(key in e for key in (
+            'demographics', 'locations', 'weather_conditions', 'time_periods', 'dates', 'aggregations'
+        )),
+        id="complex_query"
+    ),
+]
 
-    def test_extract_entities_measurements(self, nlp_service):
-        """Test measurement extraction"""
-        question = "What's the total distance traveled in kilometers?"
-        entities = nlp_service.extract_entities(question)
-        
-        assert 'measurements' in entities
-        assert any('distance' in measure.lower() for measure in entities['measurements'])
-        assert 'aggregations' in entities
-        assert 'total' in entities['aggregations']
+class TestNLPService:
+    """Unit tests for NLPService class"""
 
-    def test_extract_entities_complex_query(self, nlp_service):
-        """Test entity extraction from complex queries"""
-        question = "What was the average ride time for women starting from Congress Avenue on rainy weekends in June 2025?"
+    @pytest.mark.parametrize("question,check", CASES)
+    def test_extract_entities(self, nlp_service, question, check):
+        """Test entity extraction for each kind of question"""
         entities = nlp_service.extract_entities(question)
         
-        assert 'demographics' in entities
-        assert 'locations' in entities
-        assert 'weather_conditions' in entities
-        assert 'time_periods' in entities
-        assert 'dates' in entities
-        assert 'aggregations' in entities
+        assert check(entities), f"Unexpected entities for {question!r}: {entities}"
 
-    def test_extract_entities_empty_query(self, nlp_service):
-        """Test handling of empty queries"""
-        entities = nlp_service.extract_entities("")
-        
-        assert all(isinstance(value, list) for value in entities.values())
-        assert all(len(value) == 0 for value in entities.values())
+    @pytest.mark.parametrize("question", [
+        pytest.param("", id="empty_query"),
+        pytest.param(None, id="invalid_input"),
+    ])
+    def test_extract_entities_empty_like(self, nlp_service, question):
+        """Test that empty and missing questions yield no entities"""
+        _assert_entities_empty(nlp_service.extract_entities(question))
 
-    def test_extract_entities_invalid_input(self, nlp_service):
-        """Test handling of invalid input"""
-        entities = nlp_service.extract_entities(None)
+    def test_extract_entities_cached(self, nlp_service):
+        """Test that repeated questions reuse the extraction but not the result dict"""
+        first = nlp_service.extract_entities("How many trips on rainy days?")
+        first['weather_conditions'].append('sunny')
+        second = nlp_service.extract_entities("  how many TRIPS on rainy days? ")
         
-        assert all(isinstance(value, list) for value in entities.values())
-        assert all(len(value) == 0 for value in entities.values())
+        assert second['weather_conditions'] == ['rainy']
+        assert nlp_service._extract_entities_cached.cache_info().hits == 1
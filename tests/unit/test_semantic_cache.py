@@ -0,0 +1,105 @@
+import pytest
+from unittest.mock import Mock
+from semantic_cache import SemanticCache, entity_signature
+
+class TestSemanticCache:
+    """Unit tests for SemanticCache class"""
+
+    @pytest.fixture
+    def embedder(self):
+        """Embed every question onto the same vector so only the entity guard decides"""
+        return Mock(return_value=[1.0, 0.0])
+
+    @pytest.fixture
+    def cache(self, embedder):
+        """Create a SemanticCache with a stub embedder"""
+        return SemanticCache(embedder, maxsize=2)
+
+    def test_exact_repeat_skips_generation(self, cache, embedder):
+        """Test that a repeated question is served without generating or embedding again"""
+        generate = Mock(return_value={'sql': 'SELECT 1', 'params': [], 'error': None})
+        entities = {'aggregations': ['count']}
+
+        cache.get_or_generate("How many trips?", entities, generate)
+        result = cache.get_or_generate("  how many   TRIPS? ", entities, generate)
+
+        assert result['sql'] == 'SELECT 1'
+        assert generate.call_count == 1
+        embedder.assert_not_called()
+
+    def test_similar_question_hits(self, cache):
+        """Test that a paraphrase with the same entities reuses the cached SQL"""
+        entities = {'aggregations': ['count'], 'weather_conditions': ['rainy']}
+        cache.get_or_generate("How many trips on rainy days?", entities,
+                              lambda: {'sql': 'SELECT 1', 'params': [], 'error': None})
+
+        generate = Mock()
+        result = cache.get_or_generate("Count the trips on rainy days", entities, generate)
+
+        assert result['sql'] == 'SELECT 1'
+        generate.assert_not_called()
+
+    def test_entity_guard_prevents_false_hit(self, cache):
+        """Test that similar questions with different entities are not conflated"""
+        cache.get_or_generate("Trips by women", {'demographics': [{'type': 'gender', 'value': 'women'}]},
+                              lambda: {'sql': 'SELECT 1', 'params': [], 'error': None})
+
+        generate = Mock(return_value={'sql': 'SELECT 2', 'params': [], 'error': None})
+        result = cache.get_or_generate("Trips by men", {'demographics': [{'type': 'gender', 'value': 'men'}]},
+                                       generate)
+
+        assert result['sql'] == 'SELECT 2'
+        generate.assert_called_once()
+
+    def test_partial_entity_overlap_is_a_miss(self, cache, embedder):
+        """Test that sharing most but not all entities is not enough to reuse SQL"""
+        entities = {'numbers': [str(i) for i in range(10)], 'aggregations': ['count']}
+        cache.get_or_generate("Trips with these numbers", entities,
+                              lambda: {'sql': 'SELECT 1', 'params': [], 'error': None})
+
+        generate = Mock(return_value={'sql': 'SELECT 2', 'params': [], 'error': None})
+        result = cache.get_or_generate("Trips with those numbers",
+                                       {**entities, 'numbers': entities['numbers'][:9] + ['11']}, generate)
+
+        assert result['sql'] == 'SELECT 2'
+        generate.assert_called_once()
+        # No cached entry shared the entities, so nothing was embedded
+        embedder.assert_not_called()
+
+    def test_errors_are_not_cached(self, cache):
+        """Test that failed generations are retried"""
+        generate = Mock(return_value={'sql': None, 'params': [], 'error': 'LLM failed'})
+
+        cache.get_or_generate("test question", {}, generate)
+        cache.get_or_generate("test question", {}, generate)
+
+        assert generate.call_count == 2
+
+    def test_embedder_failure_falls_back(self, cache, embedder):
+        """Test that an embedding error only disables similarity matching"""
+        embedder.side_effect = Exception("API Error")
+        generate = Mock(return_value={'sql': 'SELECT 1', 'params': [], 'error': None})
+
+        assert cache.get_or_generate("test question", {}, generate)['sql'] == 'SELECT 1'
+        assert cache.get_or_generate("test question", {}, generate)['sql'] == 'SELECT 1'
+        assert generate.call_count == 1
+
+    def test_lru_eviction(self, cache):
+        """Test that the least recently used entry is evicted"""
+        for i in range(3):
+            cache.get_or_generate(f"question {i}", {'numbers': [str(i)]},
+                                  lambda i=i: {'sql': f'SELECT {i}', 'params': [], 'error': None})
+
+        generate = Mock(return_value={'sql': 'SELECT 0', 'params': [], 'error': None})
+        cache.get_or_generate("question 0", {'numbers': ['0']}, generate)
+
+        generate.assert_called_once()
+
+    def test_entity_signature(self):
+        """Test entity signature flattening"""
+        a = entity_signature({'aggregations': ['count'], 'demographics': [{'type': 'gender', 'value': 'women'}]})
+        b = entity_signature({'demographics': [{'type': 'gender', 'value': 'women'}], 'aggregations': ['count']})
+
+        assert a == frozenset({'aggregations:count', 'demographics:gender:women'})
+        assert a == b
+        assert entity_signature({}) == frozenset()